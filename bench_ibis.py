@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# ------------------------------------------------------------------------------
+# Benchmarks for the Ibis package. To run the benchmarks, execute this file.
+#
+#     ./bench_ibis.py [--output <file>] [--compare <baseline>] [--filter <text>]
+#     ./bench_ibis.py --stress <seconds>
+#
+# Each benchmark is timed `--repeat` times. Results can be saved to a JSON file
+# and later runs compared against it: a benchmark is reported as slower if its
+# median time has increased by more than `--threshold` and a Mann-Whitney U test
+# on the samples is significant at level `--alpha`. The script exits with a
+# non-zero status if any benchmark is slower than the baseline.
+#
+# The --stress option instead renders templates from 1, 2, 4 and 8 threads while
+# the template files are being rewritten, checks every output, and reports the
+# throughput relative to a single thread. Threads only speed up rendering on
+# free-threaded builds of CPython.
+# ------------------------------------------------------------------------------
+
+import argparse
+import collections
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import ibis
+
+
+# ------------------------------------------------------------------------------
+# Benchmarks.
+# ------------------------------------------------------------------------------
+
+
+# List of registered (name, setup) tuples. Each setup function prepares a workload
+# and returns a function of no arguments which runs it once. Setup functions may
+# assign a template loader to `ibis.loader`; it's restored after the benchmark.
+benchmarks = []
+
+
+def benchmark(setup):
+    benchmarks.append((setup.__name__, setup))
+    return setup
+
+
+def tag_dense_template(count=2000):
+    chunk = (
+        '{% if a %}{{ b.c|upper }}{% else %}{$ d $}{% endif %}'
+        '{% for i in items %}{{ i }},{% endfor %}\n'
+    )
+    return chunk * count
+
+
+def text_template(size=1_000_000):
+    line = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.\n"
+    return line * (size // len(line))
+
+
+tag_data = {'a': True, 'b': {'c': 'foo'}, 'd': '<bar>', 'items': [1, 2, 3]}
+
+
+@benchmark
+def lex_text():
+    string = text_template()
+    return lambda: ibis.compiler.Lexer(string, 'bench').tokenize()
+
+
+@benchmark
+def lex_tags():
+    string = tag_dense_template()
+    return lambda: ibis.compiler.Lexer(string, 'bench').tokenize()
+
+
+@benchmark
+def compile_text():
+    string = text_template()
+    return lambda: ibis.Template(string, 'bench')
+
+
+@benchmark
+def compile_tags():
+    string = tag_dense_template()
+    return lambda: ibis.Template(string, 'bench')
+
+
+@benchmark
+def render_text():
+    template = ibis.Template(text_template(), 'bench')
+    return lambda: template.render()
+
+
+@benchmark
+def render_tags():
+    template = ibis.Template(tag_dense_template(), 'bench')
+    return lambda: template.render(tag_data)
+
+
+@benchmark
+def render_inheritance(depth=30):
+    templates = {'level-0': '<{% block content %}base{% endblock %}>'}
+    for level in range(1, depth):
+        templates[f'level-{level}'] = (
+            f'{{% extends "level-{level - 1}" %}}'
+            f'{{% block content %}}{{{{ super() }}}}|{level}-{{{{ var }}}}{{% endblock %}}'
+        )
+    ibis.loader = ibis.loaders.DictLoader(templates)
+    template = ibis.loader(f'level-{depth - 1}')
+    return lambda: template.render(var='foo')
+
+
+@benchmark
+def render_include_loop(count=1000):
+    ibis.loader = ibis.loaders.DictLoader({
+        'item': '<li>{{ item.name }}: {{ item.value|default("none") }}</li>',
+    })
+    template = ibis.Template('{% for item in items %}{% include "item" %}{% endfor %}', 'bench')
+    items = [{'name': f'item-{i}', 'value': i} for i in range(count)]
+    return lambda: template.render(items=items)
+
+
+@benchmark
+def render_nested_loops(width=100):
+    template = ibis.Template(
+        '{% for row in rows %}'
+        '{% for cell in row %}{{ loop.parent.index }}.{{ loop.index }}={{ cell }} {% endfor %}\n'
+        '{% endfor %}',
+        'bench'
+    )
+    rows = [list(range(width)) for _ in range(width)]
+    return lambda: template.render(rows=rows)
+
+
+@benchmark
+def render_filters(count=500):
+    template = ibis.Template(
+        '{% for post in posts %}'
+        '{{ post.title|lower|titlecase|truncatechars(30)|escape }}'
+        '{{ post.tags|reversed|join(", ")|upper }}'
+        '{{ post.body|striptags|truncatewords(5) }}'
+        '{{ post.missing|default("-")|len }}\n'
+        '{% endfor %}',
+        'bench'
+    )
+    posts = [
+        {
+            'title': f'THE TITLE OF POST <{i}> & SOME MORE WORDS',
+            'tags': ['python', 'templates', str(i)],
+            'body': f'<p>This is the <b>body</b> of post {i}, which has several words.</p>',
+        }
+        for i in range(count)
+    ]
+    return lambda: template.render(posts=posts)
+
+
+@benchmark
+def render_undefined(count=1000):
+    template = ibis.Template(
+        '{% for i in items %}{{ user.missing or user.name.missing or "anon" }}{% endfor %}',
+        'bench'
+    )
+    data = {'items': range(count), 'user': {'name': 'foo'}}
+    return lambda: template.render(data)
+
+
+@benchmark
+def strict_is_defined(count=1000):
+    template = ibis.Template(
+        '{% for i in items %}'
+        '{% if is_defined("user.missing") %}{{ user.missing }}{% else %}{{ user.name }}{% endif %}'
+        '{% endfor %}',
+        'bench'
+    )
+    data = {'items': range(count), 'user': {'name': 'foo'}}
+    return lambda: template.render(data, strict_mode=True)
+
+
+@benchmark
+def strict_undefined_error():
+    template = ibis.Template('{{ user.name }}' * 100 + '{{ user.missing }}', 'bench')
+    data = {'user': {'name': 'foo'}}
+
+    def func():
+        try:
+            template.render(data, strict_mode=True)
+        except ibis.errors.UndefinedVariable:
+            pass
+
+    return func
+
+
+@benchmark
+def context_resolve(count=1000):
+    token = ibis.compiler.Token('PRINT', 'a.b.c', 'bench', 1)
+    context = ibis.context.Context({'a': {'b': {'c': 'foo'}}}, False)
+    context.push({'x': 1})
+
+    def func():
+        for _ in range(count):
+            context.resolve('a.b.c', token)
+
+    return func
+
+
+# Looks up a data variable from beneath 20 nested scopes. The cost of a lookup
+# shouldn't depend on the number of scopes; compare with context_lookup_shallow.
+@benchmark
+def context_lookup_deep(count=1000, depth=20):
+    context = ibis.context.Context({'foo': 'bar'}, False)
+    for index in range(depth):
+        context.push()
+        context[f'var{index}'] = index
+
+    def func():
+        for _ in range(count):
+            context['foo']
+
+    return func
+
+
+@benchmark
+def context_lookup_shallow(count=1000):
+    return context_lookup_deep(count, 1)
+
+
+# ------------------------------------------------------------------------------
+# Runner.
+# ------------------------------------------------------------------------------
+
+
+# Returns the number of calls to `func` which take at least `min_time` seconds.
+def calibrate(func, min_time):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+# Runs a benchmark and returns a dictionary containing the number of calls per
+# sample and a list of `repeat` samples of the mean time per call in seconds.
+def run_benchmark(setup, repeat=10, min_time=0.05):
+    default_loader = ibis.loader
+    try:
+        func = setup()
+        number = calibrate(func, min_time)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter() - start) / number)
+    finally:
+        ibis.loader = default_loader
+    return {'number': number, 'samples': samples}
+
+
+# Runs the benchmarks whose names contain `name_filter` and returns a results
+# dictionary suitable for saving as JSON.
+def run(name_filter='', repeat=10, min_time=0.05, log=None):
+    results = {
+        'ibis': ibis.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'codegen': ibis.compiler.use_codegen,
+        'benchmarks': {},
+    }
+    for name, setup in benchmarks:
+        if name_filter in name:
+            result = run_benchmark(setup, repeat, min_time)
+            results['benchmarks'][name] = result
+            if log:
+                log(f"{name:<24} {format_time(statistics.median(result['samples'])):>10}")
+    return results
+
+
+# ------------------------------------------------------------------------------
+# Concurrency stress test.
+# ------------------------------------------------------------------------------
+
+
+# Result of a stress run: the number of renders, the renders per second, the number
+# of times the template files were rewritten, the loader's stats, and a list of any
+# incorrect outputs or exceptions.
+StressResult = collections.namedtuple(
+    'StressResult', ['renders', 'throughput', 'rewrites', 'stats', 'errors']
+)
+
+
+stress_templates = {
+    'page.html': '{% extends "layout.html" %}{% block main %}{% include "partial.html" %}{% endblock %}',
+    'layout.html': '<layout-VERSION>{% block main %}{% endblock %}</layout-VERSION>',
+    'partial.html': 'partial-VERSION:{{ value }}',
+}
+
+
+stress_output = re.compile(r'<layout-(\d+)>partial-(\d+):(\d+)</layout-\1>')
+
+
+# Writes a stress test template file atomically with a distinct modification time.
+def write_stress_template(base_dir, name, version, mtime_ns):
+    path = os.path.join(base_dir, name)
+    with open(path + '.tmp', 'w') as file:
+        file.write(stress_templates[name].replace('VERSION', str(version)))
+    os.utime(path + '.tmp', ns=(mtime_ns, mtime_ns))
+    os.replace(path + '.tmp', path)
+
+
+# Renders a template which extends a layout and includes a partial from `threads`
+# threads for `duration` seconds using a FileReloader. If `reload` is true another
+# thread keeps rewriting the layout and the partial. Every output is checked, as
+# is the number of compiles.
+def stress(threads=8, duration=1.0, reload=True):
+    default_loader = ibis.loader
+    with tempfile.TemporaryDirectory() as base_dir:
+        mtime_ns = time.time_ns() - 10**12
+        for name in stress_templates:
+            write_stress_template(base_dir, name, 0, mtime_ns)
+        loader = ibis.loader = ibis.loaders.FileReloader(base_dir)
+        stop, errors, counts, rewrites = threading.Event(), [], [0] * threads, [0]
+        barrier = threading.Barrier(threads + 1)
+
+        def render(index):
+            barrier.wait()
+            while not stop.is_set():
+                try:
+                    output = loader('page.html').render(value=index)
+                    match = stress_output.fullmatch(output)
+                    if not match or match.group(3) != str(index):
+                        errors.append(output)
+                except Exception as err:
+                    errors.append(err)
+                counts[index] += 1
+
+        workers = [threading.Thread(target=render, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < duration:
+                if reload:
+                    rewrites[0] += 1
+                    for name in ('layout.html', 'partial.html'):
+                        write_stress_template(base_dir, name, rewrites[0], mtime_ns + rewrites[0] * 10**6)
+                time.sleep(0.001)
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        elapsed = time.perf_counter() - start
+
+        # Once the files stop changing every render should see the latest versions.
+        try:
+            expected = f'<layout-{rewrites[0]}>partial-{rewrites[0]}:0</layout-{rewrites[0]}>'
+            if (output := loader('page.html').render(value=0)) != expected:
+                errors.append(output)
+        finally:
+            ibis.loader = default_loader
+
+        # Each version of each file should have been compiled at most once.
+        max_compiles = len(stress_templates) + 2 * rewrites[0]
+        if (compiles := loader.stats()['compiles']) > max_compiles:
+            errors.append(f"{compiles} compiles, expected at most {max_compiles}")
+    return StressResult(sum(counts), sum(counts) / elapsed, rewrites[0], loader.stats(), errors)
+
+
+# Runs the stress test with increasing numbers of threads and prints the throughput
+# relative to a single thread. Returns the number of failed runs.
+def run_stress(duration, max_threads=8):
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f"Python {platform.python_version()}, GIL {'enabled' if gil else 'disabled'}")
+    print(f"{'threads':>7} {'renders/s':>10} {'speedup':>8} {'compiles':>9} {'rewrites':>9}")
+    failures, threads, baseline = 0, 1, None
+    while threads <= max_threads:
+        result = stress(threads, duration)
+        baseline = baseline or result.throughput
+        print(
+            f"{threads:>7} {result.throughput:>10.0f} {result.throughput / baseline:>7.2f}x "
+            f"{result.stats['compiles']:>9} {result.rewrites:>9}"
+        )
+        for error in result.errors[:5]:
+            print(f"  Error: {error!r}")
+        failures += bool(result.errors)
+        threads *= 2
+    return failures
+
+
+# ------------------------------------------------------------------------------
+# Comparison.
+# ------------------------------------------------------------------------------
+
+
+# Returns the one-sided p-value of a Mann-Whitney U test of the hypothesis that
+# samples from `current` tend to be larger than samples from `baseline`, using the
+# normal approximation with a continuity correction.
+def mann_whitney_p(baseline, current):
+    n1, n2 = len(baseline), len(current)
+    combined = sorted([(value, 0) for value in baseline] + [(value, 1) for value in current])
+    ranks = [0.0] * len(combined)
+    start = 0
+    while start < len(combined):
+        end = start
+        while end + 1 < len(combined) and combined[end + 1][0] == combined[start][0]:
+            end += 1
+        for index in range(start, end + 1):
+            ranks[index] = (start + end) / 2 + 1
+        start = end + 1
+    rank_sum = sum(rank for rank, (value, group) in zip(ranks, combined) if group == 1)
+    u = rank_sum - n2 * (n2 + 1) / 2
+    mean = n1 * n2 / 2
+    stdev = math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12)
+    if stdev == 0:
+        return 1.0
+    z = (u - mean - 0.5) / stdev
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+# Compares two results dictionaries. Returns a list of (name, baseline median,
+# current median, relative change, p-value, status) tuples for the benchmarks
+# present in both, where status is 'slower', 'faster' or ''.
+def compare(baseline, current, threshold=0.05, alpha=0.05):
+    rows = []
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        old_samples = baseline['benchmarks'][name]['samples']
+        new_samples = result['samples']
+        old, new = statistics.median(old_samples), statistics.median(new_samples)
+        change = new / old - 1
+        status = ''
+        if change > threshold:
+            p = mann_whitney_p(old_samples, new_samples)
+            status = 'slower' if p < alpha else ''
+        else:
+            p = mann_whitney_p(new_samples, old_samples)
+            status = 'faster' if change < -threshold and p < alpha else ''
+        rows.append((name, old, new, change, p, status))
+    return rows
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+def print_comparison(rows, baseline, current):
+    for key in ('ibis', 'python', 'implementation', 'codegen'):
+        if baseline.get(key) != current.get(key):
+            print(f"Note: {key} differs: {baseline.get(key)} (baseline), {current.get(key)} (current)")
+    print(f"{'benchmark':<24} {'baseline':>10} {'current':>10} {'change':>8} {'p':>7}")
+    for name, old, new, change, p, status in rows:
+        print(
+            f"{name:<24} {format_time(old):>10} {format_time(new):>10} "
+            f"{change:>+8.1%} {p:>7.3f}  {status}"
+        )
+
+
+# ------------------------------------------------------------------------------
+# Command line interface.
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the Ibis benchmarks.')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+        help='compare the results against a JSON file saved by --output')
+    parser.add_argument('--filter', default='',
+        help='only run benchmarks whose names contain this text')
+    parser.add_argument('--repeat', type=int, default=10,
+        help='number of samples per benchmark (default: 10)')
+    parser.add_argument('--min-time', type=float, default=0.05,
+        help='minimum duration of each sample in seconds (default: 0.05)')
+    parser.add_argument('--threshold', type=float, default=0.05,
+        help='minimum relative change in the median to report (default: 0.05)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+        help='significance level for reporting changes (default: 0.05)')
+    parser.add_argument('--codegen', action='store_true',
+        help='render using generated code')
+    parser.add_argument('--list', action='store_true',
+        help='list the benchmarks and exit')
+    parser.add_argument('--stress', type=float, metavar='SECONDS',
+        help='run the concurrency stress test for this many seconds per thread count and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, setup in benchmarks:
+            print(name)
+        return 0
+
+    if args.stress:
+        return 1 if run_stress(args.stress) else 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    use_codegen = ibis.compiler.use_codegen
+    ibis.compiler.use_codegen = args.codegen
+    try:
+        results = run(args.filter, args.repeat, args.min_time, log=None if baseline else print)
+    finally:
+        ibis.compiler.use_codegen = use_codegen
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        rows = compare(baseline, results, args.threshold, args.alpha)
+        print_comparison(rows, baseline, results)
+        if any(row[5] == 'slower' for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,9 @@ from . import nodes
 from . import loaders
 from . import errors
 from . import compiler
+from . import caches
+from . import profiler
+from . import build
 
 from .template import Template
 
@@ -15,3 +18,8 @@ __version__ = "3.3.0"
 # The callable should accept a single string argument and either return an instance of the
 # corresponding Template class or raise a TemplateLoadError exception.
 loader = None
+
+
+# Fragment cache used by the {% cache %} tag. Assign any object implementing the interface
+# described in `ibis.caches` or assign None to disable fragment caching.
+cache = caches.LRUCache()
@@ -0,0 +1,78 @@
+# Command line interface. Run `python -m ibis --help` for details.
+#
+#     python -m ibis precompile <base-dirs> [--cache-dir <dir>] [--pattern <glob>] [--workers <n>]
+#
+#     python -m ibis build <base-dirs> --data <dir> --output <dir> [--workers <n>] [--force]
+#
+import argparse
+import sys
+import ibis
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ibis')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    precompile_parser = subparsers.add_parser(
+        'precompile',
+        help='compile every template under the base directories and report any errors',
+    )
+    precompile_parser.add_argument('base_dirs', nargs='+', metavar='base-dir',
+        help='template directory, in order of priority')
+    precompile_parser.add_argument('--cache-dir',
+        help='save the compiled templates to this disk cache directory')
+    precompile_parser.add_argument('--pattern', default='*',
+        help='only compile templates whose names match this glob pattern')
+    precompile_parser.add_argument('--workers', type=int,
+        help='number of worker processes, 0 to compile in this process (default: CPU count)')
+    precompile_parser.set_defaults(func=precompile_command)
+
+    build_parser = subparsers.add_parser(
+        'build',
+        help='render a page for each data file in a directory tree',
+    )
+    build_parser.add_argument('base_dirs', nargs='+', metavar='base-dir',
+        help='template directory, in order of priority')
+    build_parser.add_argument('--data', required=True,
+        help='directory of JSON or YAML page data files')
+    build_parser.add_argument('--output', required=True,
+        help='output directory')
+    build_parser.add_argument('--cache-dir',
+        help='disk cache directory for compiled templates')
+    build_parser.add_argument('--workers', type=int,
+        help='number of worker processes, 0 to render in this process (default: CPU count)')
+    build_parser.add_argument('--force', action='store_true',
+        help='rebuild pages even if they are unchanged')
+    build_parser.set_defaults(func=build_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def precompile_command(args):
+    loader = ibis.loaders.FileLoader(*args.base_dirs, cache_dir=args.cache_dir)
+    try:
+        names = loader.precompile(args.pattern, args.workers)
+    except ibis.errors.PrecompileError as err:
+        compiled = len(loader.cache)
+        sys.stderr.write(f"Error: {err}\n")
+        print(f"Compiled {compiled} template(s), {len(err.errors)} failed.")
+        return 1
+    print(f"Compiled {len(names)} template(s).")
+    return 0
+
+
+def build_command(args):
+    result = ibis.build.build(
+        args.base_dirs, args.data, args.output,
+        workers=args.workers, cache_dir=args.cache_dir, force=args.force,
+    )
+    for page_name, err in result.errors.items():
+        sys.stderr.write(f"Error: {page_name}: {err}\n")
+    msg = f"Built {len(result.built)} page(s), skipped {len(result.skipped)} unchanged page(s)"
+    print(f"{msg}, {len(result.errors)} failed." if result.errors else f"{msg}.")
+    return 1 if result.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
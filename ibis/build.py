@@ -0,0 +1,181 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import ibis
+
+from .errors import TemplateError, TemplateLoadError
+
+
+# Name of the build manifest file written to the output directory.
+manifest_name = '.ibis-manifest.json'
+
+
+# File extensions recognised as page data files.
+data_extensions = ('.json', '.yaml', '.yml')
+
+
+# Summary of a build: lists of the built and skipped page names and a dictionary mapping the names
+# of failed pages to their exceptions.
+BuildResult = collections.namedtuple('BuildResult', ['built', 'skipped', 'errors'])
+
+
+# Builds a static site by rendering one page for each data file in `data_dir`.
+#
+# Each data file contains a JSON (or, if PyYAML is installed, YAML) object which is used as the
+# page's template data. The page's output path is the data file's path relative to `data_dir`
+# without the data file extension, e.g. 'blog/post.html.json' is rendered to 'blog/post.html' in
+# `output_dir`. The page is rendered using the template named by the data's 'template' key or, if
+# there is no 'template' key, the template with the same name as the output path. Templates are
+# loaded from `template_dirs` using a FileLoader.
+#
+# Pages are rendered in a pool of `workers` processes, each with its own FileLoader which caches
+# templates across pages; the default is the number of CPUs, or specify 0 to render in the current
+# process. Output files are written atomically.
+#
+# A manifest in the output directory records a hash of each page's data file and of the template
+# files it depends on --- its template, the templates it extends, and the templates they include
+# by name. Pages whose hashes are unchanged and whose output files exist are skipped unless `force`
+# is true. Note that templates included using variable names aren't tracked.
+def build(template_dirs, data_dir, output_dir, workers=None, cache_dir=None, force=False):
+    loader = ibis.loaders.FileLoader(*template_dirs, cache_dir=cache_dir)
+    manifest_path = os.path.join(output_dir, manifest_name)
+    old_manifest = read_manifest(manifest_path)
+    manifest, pending, skipped, errors, file_hashes = {}, [], [], {}, {}
+
+    for page_name, data_path in find_pages(data_dir):
+        try:
+            with open(data_path, 'rb') as file:
+                data_bytes = file.read()
+            data = parse_data(data_path, data_bytes)
+            template_name = data.get('template', page_name)
+            if not isinstance(template_name, str):
+                msg = f"The 'template' key in the data file '{data_path}' must be a string."
+                raise ValueError(msg)
+            digest = page_digest(loader, template_name, data_bytes, file_hashes)
+        except (OSError, ValueError, TemplateError) as err:
+            errors[page_name] = err
+            continue
+        output_path = os.path.join(output_dir, *page_name.split('/'))
+        if not force and old_manifest.get(page_name) == digest and os.path.isfile(output_path):
+            manifest[page_name] = digest
+            skipped.append(page_name)
+            continue
+        pending.append((page_name, template_name, data, output_path, digest))
+
+    args = [[page[index] for page in pending] for index in (1, 2, 3)]
+    if workers == 0:
+        default_loader = ibis.loader
+        try:
+            init_worker(template_dirs, cache_dir)
+            results = list(map(render_page, *args))
+        finally:
+            ibis.loader = default_loader
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(template_dirs, cache_dir)
+        ) as executor:
+            chunksize = max(1, len(pending) // ((workers or os.cpu_count() or 1) * 4))
+            results = list(executor.map(render_page, *args, chunksize=chunksize))
+
+    built = []
+    for (page_name, template_name, data, output_path, digest), err in zip(pending, results):
+        if err:
+            errors[page_name] = err
+        else:
+            manifest[page_name] = digest
+            built.append(page_name)
+
+    write_file(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+    return BuildResult(built, skipped, errors)
+
+
+# Yields a (page_name, data_path) tuple for each data file under the data directory.
+def find_pages(data_dir):
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            if ext in data_extensions and not filename.startswith('.'):
+                path = os.path.join(dirpath, filename)
+                page_name = os.path.relpath(os.path.join(dirpath, base), data_dir)
+                yield page_name.replace(os.sep, '/'), path
+
+
+def parse_data(path, data_bytes):
+    if path.endswith('.json'):
+        data = json.loads(data_bytes.decode('utf-8'))
+    else:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"PyYAML is required to load the data file '{path}'.") from None
+        data = yaml.safe_load(data_bytes)
+    if not isinstance(data, dict):
+        raise ValueError(f"The data file '{path}' must contain an object.")
+    return data
+
+
+# Returns a hash of the page's data and of the files of the templates it depends on. Templates are
+# compiled and cached by the loader to find their dependencies; file hashes are cached in the
+# `file_hashes` dictionary.
+def page_digest(loader, template_name, data_bytes, file_hashes):
+    names, stack = {template_name}, [template_name]
+    while stack:
+        for name in loader(stack.pop()).dependencies():
+            if name not in names:
+                names.add(name)
+                stack.append(name)
+
+    digest = hashlib.sha256()
+    digest.update(ibis.__version__.encode('utf-8'))
+    digest.update(template_name.encode('utf-8'))
+    for name in sorted(names):
+        if name not in file_hashes:
+            path = loader.locate(name)
+            if path is None:
+                raise TemplateLoadError(f"Cannot locate the template file '{name}'.")
+            with open(path, 'rb') as file:
+                file_hashes[name] = hashlib.sha256(file.read()).hexdigest()
+        digest.update(f"{name}:{file_hashes[name]}".encode('utf-8'))
+    digest.update(data_bytes)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+# Writes a text file atomically by writing to a temporary file and then renaming it.
+def write_file(path, text):
+    dirname = os.path.dirname(path) or '.'
+    os.makedirs(dirname, exist_ok=True)
+    tmp_path = os.path.join(dirname, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def init_worker(template_dirs, cache_dir):
+    ibis.loader = ibis.loaders.FileLoader(*template_dirs, cache_dir=cache_dir)
+
+
+# Renders a page and writes its output file. Returns None or the exception if the page failed.
+def render_page(template_name, data, output_path):
+    try:
+        write_file(output_path, ibis.loader(template_name).render(data))
+    except (OSError, TemplateError) as err:
+        return err
+    return None
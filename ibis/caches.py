@@ -0,0 +1,215 @@
+import collections
+import sys
+import threading
+import time
+import ibis
+
+from .context import Context, Undefined
+
+
+# Caches for the {% cache %} tag's rendered fragments.
+#
+# A fragment cache can be any object with the following methods:
+#
+#     get(key)                 -> the cached string or None if the key is missing or expired
+#     set(key, value, ttl)     -> stores the string for `ttl` seconds (None for the default)
+#
+# Assign a fragment cache to `ibis.cache` to enable caching for the {% cache %} tag.
+
+
+# Thread-safe in-process cache with least-recently-used eviction. The cache is bounded by its
+# number of entries and/or by the approximate total size of its values in bytes. Entries
+# can be given a time-to-live in seconds; `ttl` sets the default for entries stored without one.
+class LRUCache:
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            value, size, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self.remove(key)
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        size = sys.getsizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, expires)
+            self.size += size
+            while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                    (self.max_bytes is not None and self.size > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    # Returns a dictionary of hit, miss, eviction and expiration counts along with the cache's
+    # current number of entries and approximate size in bytes.
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'evictions': self.counters['evictions'],
+                'expirations': self.counters['expirations'],
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+    # Removes an entry. The caller must hold the lock.
+    def remove(self, key):
+        value, size, expires = self.entries.pop(key)
+        self.size -= size
+
+
+# Functions which may be called from a template without preventing the render cache from caching
+# its output. Any other callable read from the data makes the output uncacheable.
+pure_functions = {range}
+
+
+# Caches the output of Template.render(). Assign an instance to a template's `render_cache`
+# attribute or to `Template.render_cache` to cache the output of all templates.
+#
+# While rendering, the variable lookups performed by the template are recorded. The output is
+# stored in an LRU cache keyed by the looked-up variable names and a fingerprint of their values.
+# On subsequent renders the recorded variables are looked up in the new data; if their values are
+# equal to the recorded values the cached output is returned without rendering. Note that this
+# assumes that data objects aren't mutated in place between renders.
+#
+# Output is only cached if the looked-up values are hashable or are lists, tuples, dicts or sets
+# of hashable values, and if the loader has a `generation` attribute or the template doesn't
+# extend or include other templates.
+class RenderCache:
+
+    def __init__(self, max_entries=256, max_bytes=None, max_variants=8):
+        self.outputs = LRUCache(max_entries, max_bytes)
+        self.max_variants = max_variants
+        self.variants = {}
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def render(self, template, data_dict, strict_mode):
+        loader = ibis.loader
+        key = (template, strict_mode, loader, getattr(loader, 'generation', None))
+        with self.lock:
+            variants = list(self.variants.get(key, ()))
+        for accessors in reversed(variants):
+            try:
+                fingerprint = self.fingerprint(accessors, data_dict)
+            except TypeError:
+                continue
+            output = self.outputs.get((key, accessors, fingerprint))
+            if output is not None:
+                self.count('hits')
+                return output
+
+        self.count('misses')
+        context = Context(data_dict, strict_mode)
+        context.reads = []
+        output = template._render(context)
+
+        # The output isn't cached if the loader's generation changed while rendering, as the
+        # render may have used templates which were replaced; it's cached the next time the
+        # template is rendered.
+        if key[3] != getattr(loader, 'generation', None):
+            return output
+        if key[3] is None and (len(context.templates) > 1 or context.include_cache):
+            self.count('uncacheable')
+            return output
+        values = {}
+        for accessor, value in context.reads:
+            values.setdefault(accessor.varstring, (accessor, value))
+        try:
+            fingerprint = tuple(freeze(value) for accessor, value in values.values())
+        except TypeError:
+            self.count('uncacheable')
+            return output
+        accessors = tuple(accessor for accessor, value in values.values())
+        self.outputs.set((key, accessors, fingerprint), output)
+        with self.lock:
+            variants = self.variants.setdefault(key, collections.OrderedDict())
+            variants.pop(accessors, None)
+            variants[accessors] = None
+            if len(variants) > self.max_variants:
+                variants.popitem(last=False)
+        return output
+
+    # Looks up the variables in the data and returns a fingerprint of their values. Raises a
+    # TypeError if the values can't be fingerprinted.
+    def fingerprint(self, accessors, data_dict):
+        context = Context(data_dict, False)
+        return tuple(freeze(accessor.resolve(context, None)) for accessor in accessors)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def clear(self):
+        self.outputs.clear()
+        with self.lock:
+            self.variants.clear()
+
+    # Returns a dictionary of hit, miss and uncacheable render counts along with the number of
+    # evicted entries, the current number of entries and their approximate size in bytes.
+    def stats(self):
+        stats = self.outputs.stats()
+        with self.lock:
+            counters = self.counters.copy()
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'uncacheable': counters['uncacheable'],
+            'evictions': stats['evictions'],
+            'entries': stats['entries'],
+            'bytes': stats['bytes'],
+        }
+
+
+# Converts a value into a hashable fingerprint which compares equal only to fingerprints of
+# values of the same types which are equal and iterate in the same order. Raises a TypeError if
+# the value is an impure callable or can't be converted.
+def freeze(obj):
+    cls = type(obj)
+    if cls is Undefined:
+        return Undefined
+    if cls in (list, tuple, set, frozenset):
+        return (cls, tuple(freeze(item) for item in obj))
+    if cls is dict:
+        return (cls, tuple((freeze(key), freeze(value)) for key, value in obj.items()))
+    if cls is Context or callable(obj) and obj not in pure_functions:
+        raise TypeError(f"cannot fingerprint {obj!r}")
+    hash(obj)
+    return (cls, obj)
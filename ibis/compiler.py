@@ -1,5 +1,11 @@
+import re
+import builtins
+import collections
+import operator
+
 from . import nodes
 from . import errors
+from . import filters
 
 
 # Token delimiters.
@@ -13,9 +19,19 @@ instruction_start = '{%'
 instruction_end = '%}'
 
 
+# Set to True to render templates using generated Python functions instead of by walking the
+# node tree. The output is identical either way.
+use_codegen = False
+
+
 # Returns the root node of the compiled node tree.
 def compile(template_string, template_id):
-    return Parser(template_string, template_id).parse()
+    return Optimizer().optimize(Parser(template_string, template_id).parse())
+
+
+# Returns a GeneratedCode instance containing the generated render functions for a node tree.
+def generate(root_node, blocks, template_id):
+    return CodeGenerator(root_node, blocks, template_id).generate()
 
 
 # Tokens come in four different types: TEXT, PRINT, EPRINT, and INSTRUCTION.
@@ -33,9 +49,16 @@ class Token:
         return f"({self.type}, {repr(self.text)}, {self.template_id}, {self.line_number})"
 
 
-# The Lexer takes a template string as input and chops it into a list of Tokens.
+# The Lexer takes a template string as input and chops it into a list of Tokens. Opening
+# delimiters are located using a compiled regex and closing delimiters using str.find() so the
+# cost of lexing scales with the number of tags rather than the number of characters. Line
+# numbers are computed from offsets by counting newlines in each consumed span.
 class Lexer:
 
+    # Compiled regexes for locating opening delimiters, cached by delimiter set as the
+    # delimiters can be customized at runtime.
+    regex_cache = {}
+
     def __init__(self, template_string, template_id):
         self.template_string = template_string
         self.template_id = template_id
@@ -44,96 +67,78 @@ class Lexer:
         self.line_number = 1
 
     def tokenize(self):
+        regex = self.get_start_regex()
+        readers = {
+            comment_start: self.read_comment_tag,
+            eprint_start: self.read_eprint_tag,
+            print_start: self.read_print_tag,
+            instruction_start: self.read_instruction_tag,
+        }
         while self.index < len(self.template_string):
-            if self.match(comment_start):
-                self.read_comment_tag()
-            elif self.match(eprint_start):
-                self.read_eprint_tag()
-            elif self.match(print_start):
-                self.read_print_tag()
-            elif self.match(instruction_start):
-                self.read_instruction_tag()
-            else:
-                self.read_text()
+            match = regex.search(self.template_string, self.index)
+            if match is None:
+                self.read_text(len(self.template_string))
+                break
+            if match.start() > self.index:
+                self.read_text(match.start())
+            readers[match.group()]()
         return self.tokens
 
-    def match(self, target):
-        if self.template_string.startswith(target, self.index):
-            return True
-        return False
+    def get_start_regex(self):
+        # Alternation order matches the priority order of the delimiter checks.
+        delimiters = (comment_start, eprint_start, print_start, instruction_start)
+        if delimiters not in self.regex_cache:
+            pattern = '|'.join(re.escape(delimiter) for delimiter in delimiters)
+            self.regex_cache[delimiters] = re.compile(pattern)
+        return self.regex_cache[delimiters]
 
-    def advance(self):
-        if self.template_string[self.index] == '\n':
-            self.line_number += 1
-        self.index += 1
+    def advance_to(self, index):
+        self.line_number += self.template_string.count('\n', self.index, index)
+        self.index = index
 
-    def read_comment_tag(self):
-        self.index += len(comment_start)
+    def read_tag(self, start_delimiter, end_delimiter):
+        self.index += len(start_delimiter)
+        start_index = self.index
         start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(comment_end):
-                self.index += len(comment_end)
-                return
-            self.advance()
-        msg = "Unclosed comment tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        end_index = self.template_string.find(end_delimiter, start_index)
+        if end_index == -1:
+            return None, start_line_number
+        self.advance_to(end_index)
+        self.index += len(end_delimiter)
+        return self.template_string[start_index:end_index].strip(), start_line_number
+
+    def read_comment_tag(self):
+        text, start_line_number = self.read_tag(comment_start, comment_end)
+        if text is None:
+            msg = "Unclosed comment tag."
+            raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
 
     def read_eprint_tag(self):
-        self.index += len(eprint_start)
-        start_index = self.index
-        start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(eprint_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("EPRINT", text, self.template_id, start_line_number))
-                self.index += len(eprint_end)
-                return
-            self.advance()
-        msg = "Unclosed escaped-print tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        text, start_line_number = self.read_tag(eprint_start, eprint_end)
+        if text is None:
+            msg = "Unclosed escaped-print tag."
+            raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        self.tokens.append(Token("EPRINT", text, self.template_id, start_line_number))
 
     def read_print_tag(self):
-        self.index += len(print_start)
-        start_index = self.index
-        start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(print_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("PRINT", text, self.template_id, start_line_number))
-                self.index += len(print_end)
-                return
-            self.advance()
-        msg = "Unclosed print tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        text, start_line_number = self.read_tag(print_start, print_end)
+        if text is None:
+            msg = "Unclosed print tag."
+            raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        self.tokens.append(Token("PRINT", text, self.template_id, start_line_number))
 
     def read_instruction_tag(self):
-        self.index += len(instruction_start)
-        start_index = self.index
-        start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(instruction_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("INSTRUCTION", text, self.template_id, start_line_number))
-                self.index += len(instruction_end)
-                return
-            self.advance()
-        msg = f"Unclosed instruction tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        text, start_line_number = self.read_tag(instruction_start, instruction_end)
+        if text is None:
+            msg = "Unclosed instruction tag."
+            raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        self.tokens.append(Token("INSTRUCTION", text, self.template_id, start_line_number))
 
-    def read_text(self):
+    def read_text(self, end_index):
         start_index = self.index
         start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(comment_start):
-                break
-            elif self.match(eprint_start):
-                break
-            elif self.match(print_start):
-                break
-            elif self.match(instruction_start):
-                break
-            self.advance()
-        text = self.template_string[start_index:self.index]
+        self.advance_to(end_index)
+        text = self.template_string[start_index:end_index]
         self.tokens.append(Token("TEXT", text, self.template_id, start_line_number))
 
 
@@ -189,3 +194,507 @@ class Parser:
 
         return stack.pop()
 
+
+# The Optimizer rewrites a parsed node tree to reduce the work done at render time. It merges
+# adjacent text nodes and literal print nodes into single text nodes, replaces if nodes whose
+# conditions are all literals with the selected branch, and pre-renders spaceless and trim nodes
+# with static content. Only the builtin node types are rewritten; custom nodes and their children
+# are left untouched.
+class Optimizer:
+
+    container_types = (
+        nodes.Node,
+        nodes.WithNode,
+        nodes.SpacelessNode,
+        nodes.TrimNode,
+        nodes.BlockNode,
+    )
+
+    # A template only extends another if its first node is an extends node, so if folding the
+    # leading nodes would leave an extends node in first place an empty text node is kept there.
+    def optimize(self, root_node):
+        first = root_node.children[0] if root_node.children else None
+        self.optimize_node(root_node)
+        children = root_node.children
+        if children and isinstance(children[0], nodes.ExtendsNode) and children[0] is not first:
+            children.insert(0, self.text_node(first.token, ''))
+        return root_node
+
+    def optimize_node(self, node):
+        node_type = type(node)
+        if node_type is nodes.ForNode:
+            self.optimize_node(node.for_branch)
+            self.optimize_node(node.empty_branch)
+            self.join_branches(node, nodes.EmptyNode, node.for_branch, node.empty_branch)
+        elif node_type is nodes.IfNode:
+            self.optimize_node(node.true_branch)
+            self.optimize_node(node.false_branch)
+            if any(isinstance(child, nodes.ElifNode) for child in node.children):
+                self.join_branches(node, nodes.ElifNode, node.true_branch, node.false_branch)
+            else:
+                self.join_branches(node, nodes.ElseNode, node.true_branch, node.false_branch)
+        elif node_type in self.container_types:
+            node.children = self.optimize_list(node.children)
+
+    # Rebuilds the children of a node with two branches from the optimized branches, keeping the
+    # delimiter node between them, so the children don't hold nodes the optimizer has replaced.
+    def join_branches(self, node, delimiter_type, first, second):
+        for child in node.children:
+            if isinstance(child, delimiter_type):
+                node.children = first.children + [child] + second.children
+                return
+        node.children = list(first.children)
+
+    def optimize_list(self, node_list):
+        output, text_run = [], []
+        for node in node_list:
+            self.optimize_node(node)
+            for folded in self.fold(node):
+                if type(folded) is nodes.TextNode:
+                    text_run.append(folded)
+                else:
+                    self.flush_text_run(text_run, output)
+                    output.append(folded)
+        self.flush_text_run(text_run, output)
+        return output
+
+    # Merges a run of adjacent text nodes into a single text node.
+    def flush_text_run(self, text_run, output):
+        text = ''.join(node.token.text for node in text_run)
+        if text and len(text_run) == 1:
+            output.append(text_run[0])
+        elif text:
+            output.append(self.text_node(text_run[0].token, text))
+        text_run.clear()
+
+    # Returns a list of nodes to replace the node.
+    def fold(self, node):
+        node_type = type(node)
+        if node_type is nodes.PrintNode:
+            return self.fold_print(node)
+        elif node_type is nodes.IfNode:
+            return self.fold_if(node)
+        elif node_type in (nodes.SpacelessNode, nodes.TrimNode):
+            return self.fold_whitespace(node)
+        return [node]
+
+    def fold_print(self, node):
+        if node.is_ternary:
+            if not node.test_expr.is_literal:
+                return [node]
+            expr = node.true_branch_expr if node.test_expr.literal else node.false_branch_expr
+            if not expr.is_literal:
+                return [node]
+            content = expr.literal
+        else:
+            for expr in node.exprs:
+                if not expr.is_literal:
+                    return [node]
+                content = expr.literal
+                if content:
+                    break
+        return [self.text_node(node.token, node.format(content))]
+
+    def fold_if(self, node):
+        if contains_node_type(node, (nodes.BlockNode, nodes.ExtendsNode)):
+            return [node]
+        for condition_group in node.condition_groups:
+            for condition in condition_group:
+                if not condition.lhs.is_literal or (condition.op and not condition.rhs.is_literal):
+                    return [node]
+                try:
+                    is_true = node.eval_condition(condition, None)
+                except errors.TemplateError:
+                    return [node]
+                if not is_true:
+                    break
+            if is_true:
+                break
+        if is_true:
+            return node.true_branch.children
+        elif type(node.false_branch) is nodes.IfNode:
+            return self.fold_if(node.false_branch)
+        else:
+            return node.false_branch.children
+
+    def fold_whitespace(self, node):
+        if all(type(child) is nodes.TextNode for child in node.children):
+            return [self.text_node(node.token, node.wrender(None))]
+        return [node]
+
+    def text_node(self, token, text):
+        return nodes.TextNode(Token("TEXT", text, token.template_id, token.line_number))
+
+
+# Returns true if the node's subtree contains a node of one of the specified types.
+def contains_node_type(node, node_types):
+    if isinstance(node, node_types):
+        return True
+    return any(contains_node_type(child, node_types) for child in node.children)
+
+
+# Output of the code generator. The `render` function renders the template's root node; `blocks`
+# maps each block title to a function rendering the content of the template's block node.
+GeneratedCode = collections.namedtuple('GeneratedCode', 'render blocks source')
+
+
+# Renders a block using the generated block functions of the context's template chain. This is
+# the generated-code equivalent of BlockNode.wrender().
+def render_block(context, title):
+    templates = context.block_table.get(title, ())
+    return render_block_list(context, [template.code.blocks[title] for template in templates])
+
+
+def render_block_list(context, block_list):
+    if block_list:
+        block_func = block_list.pop(0)
+        context.push()
+        context['super'] = lambda: render_block_list(context, block_list)
+        output = block_func(context)
+        context.pop()
+        return output
+    else:
+        return ''
+
+
+# The CodeGenerator turns a node tree into Python source code for a single render function per
+# template (plus one per block), then compiles it. The builtin node types are lowered to native
+# control flow and expressions are inlined; nodes of any other type are rendered by calling their
+# .render() methods. Each lowered node wraps unexpected exceptions exactly as Node.render() does,
+# so error messages are unchanged.
+class CodeGenerator:
+
+    # Maximum number of statically nested blocks in a generated function before a subtree is
+    # spilled into a helper function. (CPython has a hard limit of 20.)
+    max_depth = 8
+
+    # Operators which can be inlined in generated conditions.
+    inline_operators = {
+        operator.eq: '==',
+        operator.ne: '!=',
+        operator.lt: '<',
+        operator.gt: '>',
+        operator.le: '<=',
+        operator.ge: '>=',
+        nodes.IfNode.operators['in']: 'in',
+        nodes.IfNode.operators['not in']: 'not in',
+    }
+
+    def __init__(self, root_node, blocks, template_id):
+        self.root_node = root_node
+        self.blocks = blocks
+        self.template_id = template_id
+        self.namespace = {
+            '_filters': filters,
+            '_TemplateError': errors.TemplateError,
+            '_TemplateRenderingError': errors.TemplateRenderingError,
+            '_render_block': render_block,
+            '_truth': operator.truth,
+            '_Loop': nodes.Loop,
+        }
+        self.constants = {}
+        self.functions = []
+        self.lines = []
+        self.indent = 0
+        self.depth = 0
+        self.append = '_append'
+        self.counter = 0
+        self.handlers = {
+            nodes.Node: self.gen_container,
+            nodes.TextNode: self.gen_text,
+            nodes.PrintNode: self.gen_print,
+            nodes.ForNode: self.gen_for,
+            nodes.IfNode: self.gen_if,
+            nodes.WithNode: self.gen_with,
+            nodes.IncludeNode: self.gen_include,
+            nodes.BlockNode: self.gen_block,
+            nodes.SpacelessNode: self.gen_spaceless,
+            nodes.TrimNode: self.gen_trim,
+            nodes.CacheNode: self.gen_cache,
+            nodes.ExtendsNode: self.gen_nothing,
+            nodes.EmptyNode: self.gen_nothing,
+            nodes.ElifNode: self.gen_nothing,
+            nodes.ElseNode: self.gen_nothing,
+        }
+
+    def generate(self):
+        self.gen_function('_render', 'context', self.gen_root_body, self.root_node.children)
+        block_names = {}
+        for title, block_node in self.blocks.items():
+            block_names[title] = self.name('_block')
+            self.gen_function(block_names[title], 'context', self.gen_root_body, block_node.children)
+
+        source = '\n\n'.join('\n'.join(lines) for lines in self.functions) + '\n'
+        code = builtins.compile(source, f"<ibis:{self.template_id}>", 'exec')
+        exec(code, self.namespace)
+        block_funcs = {title: self.namespace[name] for title, name in block_names.items()}
+        return GeneratedCode(self.namespace['_render'], block_funcs, source)
+
+    # -------------------------------------------------------------------------------------------
+    # Output helpers.
+    # -------------------------------------------------------------------------------------------
+
+    def name(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def const(self, obj):
+        key = id(obj)
+        if key not in self.constants:
+            name = self.name('_c')
+            self.constants[key] = name
+            self.namespace[name] = obj
+        return self.constants[key]
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def gen_function(self, name, params, body_func, *args):
+        saved = (self.lines, self.indent, self.depth, self.append)
+        self.lines, self.indent, self.depth, self.append = [f"def {name}({params}):"], 1, 0, '_append'
+        body_func(*args)
+        self.functions.append(self.lines)
+        self.lines, self.indent, self.depth, self.append = saved
+
+    def gen_root_body(self, children):
+        self.emit("_out = []")
+        self.emit("_append = _out.append")
+        self.gen_nodes(children)
+        self.emit("return ''.join(_out)")
+
+    # Generates an indented block of statements, emitting 'pass' if the block would be empty.
+    def gen_block_body(self, body_func, *args):
+        self.indent += 1
+        count = len(self.lines)
+        body_func(*args)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.indent -= 1
+
+    # Wraps the code generated for a node in a try block which re-raises unexpected exceptions
+    # as TemplateRenderingErrors, mirroring Node.render().
+    def gen_guarded(self, node, body_func, *args):
+        self.emit("try:")
+        self.depth += 1
+        self.gen_block_body(body_func, *args)
+        self.depth -= 1
+        self.emit("except _TemplateError:")
+        self.emit("    raise")
+        self.emit("except Exception as err:")
+        self.emit(f"    raise {self.const(node)}.rendering_error(err) from err")
+
+    # -------------------------------------------------------------------------------------------
+    # Expressions.
+    # -------------------------------------------------------------------------------------------
+
+    # Generates code evaluating an Expression and assigning the result to the variable `target`.
+    def gen_expr(self, expr, target):
+        if expr.is_literal:
+            self.emit(f"{target} = {self.const(expr.literal)}")
+            return
+        token = self.const(expr.token)
+        self.emit(f"{target} = {self.const(expr.accessor)}.resolve(context, {token})")
+        if expr.is_func_call:
+            msg = f"Error calling function '{expr.varstring}'."
+            self.gen_try_call(f"{target} = {target}(*{self.const(expr.func_args)})", msg, token)
+        for name, func, args in expr.filters:
+            msg = f"Error applying filter '{name}'."
+            self.gen_try_call(f"{target} = {self.const(func)}({target}, *{self.const(args)})", msg, token)
+
+    def gen_try_call(self, statement, msg, token):
+        self.emit("try:")
+        self.emit(f"    {statement}")
+        self.emit("except Exception as err:")
+        self.emit(f"    raise _TemplateRenderingError({msg!r}, {token}) from err")
+
+    # -------------------------------------------------------------------------------------------
+    # Nodes.
+    # -------------------------------------------------------------------------------------------
+
+    def gen_nodes(self, node_list):
+        for node in node_list:
+            self.gen_node(node)
+
+    def gen_node(self, node):
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            self.emit(f"{self.append}({self.const(node)}.render(context))")
+        elif self.depth >= self.max_depth and handler not in (self.gen_text, self.gen_nothing):
+            name = self.name('_spill')
+            self.gen_function(name, 'context, _append', handler, node)
+            self.emit(f"{name}(context, {self.append})")
+        else:
+            handler(node)
+
+    def gen_nothing(self, node):
+        pass
+
+    def gen_container(self, node):
+        self.gen_nodes(node.children)
+
+    def gen_text(self, node):
+        self.emit(f"{self.append}({self.const(node.token.text)})")
+
+    def gen_print(self, node):
+        self.gen_guarded(node, self.gen_print_body, node)
+
+    def gen_print_body(self, node):
+        value = self.name('_v')
+        if node.is_ternary:
+            self.gen_expr(node.test_expr, value)
+            self.emit(f"if {value}:")
+            self.gen_block_body(self.gen_expr, node.true_branch_expr, value)
+            self.emit("else:")
+            self.gen_block_body(self.gen_expr, node.false_branch_expr, value)
+        else:
+            self.gen_expr(node.exprs[0], value)
+            for expr in node.exprs[1:]:
+                self.emit(f"if not {value}:")
+                self.gen_block_body(self.gen_expr, expr, value)
+        if node.token.type == "EPRINT":
+            self.emit(f"{self.append}(_filters.escape(str({value})))")
+        else:
+            self.emit(f"{self.append}(str({value}))")
+
+    def gen_for(self, node):
+        self.gen_guarded(node, self.gen_for_body, node)
+
+    def gen_for_body(self, node):
+        collection, item = self.name('_coll'), self.name('_item')
+        self.gen_expr(node.expr, collection)
+        self.emit(f"if {collection} and hasattr({collection}, '__iter__'):")
+        self.indent += 1
+        self.emit(f"if hasattr({collection}, '__len__'):")
+        self.emit(f"    {collection} = list({collection})")
+        self.emit("context.push()")
+        if node.uses_loop:
+            self.emit(f"{collection} = _Loop({collection}, context.get('loop'))")
+            self.emit(f"context['loop'] = {collection}")
+        self.emit(f"for {item} in {collection}:")
+        self.indent += 1
+        self.depth += 1
+        if len(node.loopvars) > 1:
+            self.emit(f"{self.const(node)}.unpack(context, {item})")
+        else:
+            self.emit(f"context[{node.loopvars[0]!r}] = {item}")
+        self.gen_node(node.for_branch)
+        self.depth -= 1
+        self.indent -= 1
+        self.emit("context.pop()")
+        self.indent -= 1
+        self.emit("else:")
+        self.gen_block_body(self.gen_node, node.empty_branch)
+
+    def gen_if(self, node):
+        self.gen_guarded(node, self.gen_if_body, node)
+
+    def gen_if_body(self, node):
+        result = self.name('_cond')
+        for group_index, condition_group in enumerate(node.condition_groups):
+            if group_index > 0:
+                self.emit(f"if not {result}:")
+                self.indent += 1
+            for cond_index, condition in enumerate(condition_group):
+                if cond_index > 0:
+                    self.emit(f"if {result}:")
+                    self.gen_block_body(self.gen_condition, node, condition, result)
+                else:
+                    self.gen_condition(node, condition, result)
+            if group_index > 0:
+                self.indent -= 1
+        self.emit(f"if {result}:")
+        self.gen_block_body(self.gen_node, node.true_branch)
+        self.emit("else:")
+        self.gen_block_body(self.gen_node, node.false_branch)
+
+    def gen_condition(self, node, cond, result):
+        lhs, rhs = self.name('_lhs'), self.name('_rhs')
+        self.emit("try:")
+        self.indent += 1
+        self.gen_expr(cond.lhs, lhs)
+        if cond.op:
+            self.gen_expr(cond.rhs, rhs)
+            if cond.op in self.inline_operators:
+                self.emit(f"{result} = {lhs} {self.inline_operators[cond.op]} {rhs}")
+            else:
+                self.emit(f"{result} = {self.const(cond.op)}({lhs}, {rhs})")
+        else:
+            self.emit(f"{result} = _truth({lhs})")
+        self.indent -= 1
+        self.emit("except Exception as err:")
+        msg = f"An exception was raised while evaluating the condition in the '{node.tag}' tag."
+        self.emit(f"    raise _TemplateRenderingError({msg!r}, {self.const(node.token)}) from err")
+        if cond.negated:
+            self.emit(f"{result} = not {result}")
+
+    def gen_with(self, node):
+        self.gen_guarded(node, self.gen_with_body, node)
+
+    def gen_with_body(self, node):
+        self.emit("context.push()")
+        self.gen_variables(node.variables)
+        self.gen_nodes(node.children)
+        self.emit("context.pop()")
+
+    def gen_variables(self, variables):
+        for name, expr in variables.items():
+            value = self.name('_v')
+            self.gen_expr(expr, value)
+            self.emit(f"context[{name!r}] = {value}")
+
+    def gen_include(self, node):
+        self.gen_guarded(node, self.gen_include_body, node)
+
+    def gen_include_body(self, node):
+        template_name, template = self.name('_name'), self.name('_template')
+        self.gen_expr(node.template_expr, template_name)
+        self.emit(f"{template} = {self.const(node)}.load_template({template_name}, context)")
+        self.emit("context.push()")
+        self.gen_variables(node.variables)
+        self.emit(f"{self.append}({template}.code.render(context))")
+        self.emit("context.pop()")
+
+    def gen_block(self, node):
+        self.gen_guarded(node, self.gen_block_body_call, node)
+
+    def gen_block_body_call(self, node):
+        self.emit(f"{self.append}(_render_block(context, {node.title!r}))")
+
+    def gen_spaceless(self, node):
+        self.gen_guarded(node, self.gen_buffered, node, "_filters.spaceless({}).strip()")
+
+    def gen_trim(self, node):
+        self.gen_guarded(node, self.gen_buffered, node, "{}.strip()")
+
+    def gen_cache(self, node):
+        self.gen_guarded(node, self.gen_cache_body, node)
+
+    # Only renders the node's children if the fragment cache misses.
+    def gen_cache_body(self, node):
+        cache, key, output = self.name('_cache'), self.name('_key'), self.name('_frag')
+        self.emit(f"{cache}, {key}, {output} = {self.const(node)}.lookup(context)")
+        self.emit(f"if {output} is None:")
+        self.indent += 1
+        buffer, outer_append = self.name('_buf'), self.append
+        self.emit(f"{buffer} = []")
+        self.emit(f"{buffer}_append = {buffer}.append")
+        self.append = f"{buffer}_append"
+        self.gen_nodes(node.children)
+        self.append = outer_append
+        self.emit(f"{output} = ''.join({buffer})")
+        self.emit(f"{self.const(node)}.store({cache}, {key}, {output}, context)")
+        self.indent -= 1
+        self.emit(f"{self.append}({output})")
+
+    # Renders the node's children into a local buffer, then appends the buffered output after
+    # applying the `transform` format string to it.
+    def gen_buffered(self, node, transform):
+        buffer, outer_append = self.name('_buf'), self.append
+        self.emit(f"{buffer} = []")
+        self.emit(f"{buffer}_append = {buffer}.append")
+        self.append = f"{buffer}_append"
+        self.gen_nodes(node.children)
+        self.append = outer_append
+        output = transform.format(f"''.join({buffer})")
+        self.emit(f"{outer_append}({output})")
+
@@ -1,4 +1,7 @@
+import asyncio
 import datetime
+import inspect
+import types
 from . import errors
 
 
@@ -9,38 +12,92 @@ builtins = {
 }
 
 
-# A wrapper around a stack of dictionaries.
+# Marks a variable which was unset before being shadowed by a scope.
+unset = object()
+
+
+# Scoped variable storage for a Context. The base layers --- the standard builtins, the
+# user-configurable builtins, and the user's data dictionary --- are searched newest first.
+# Variables set in pushed scopes are stored in a single flattened dictionary with each scope
+# recording the values it shadows so they can be restored when the scope is popped. Lookups and
+# push/pop are constant-time regardless of the scope depth, and a scope can be reused for any
+# number of assignments (e.g. one per loop iteration) without growing.
 class DataStack:
 
-    def __init__(self):
-       self.stack = []
+    def __init__(self, *layers):
+        self.layers = tuple(reversed(layers))
+        self.scope = {}
+        self.shadowed = []
 
     def __getitem__(self, key):
-        for d in reversed(self.stack):
+        try:
+            return self.scope[key]
+        except KeyError:
+            pass
+        for d in self.layers:
             if key in d:
                 return d[key]
         raise KeyError(key)
 
+    def __contains__(self, key):
+        if key in self.scope:
+            return True
+        return any(key in d for d in self.layers)
+
+    # Sets a variable in the current scope. If no scope has been pushed the variable is set in
+    # the user's data dictionary.
+    def __setitem__(self, key, value):
+        if self.shadowed:
+            frame = self.shadowed[-1]
+            if key not in frame:
+                frame[key] = self.scope.get(key, unset)
+            self.scope[key] = value
+        else:
+            self.layers[0][key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def push(self):
+        self.shadowed.append({})
+
+    def pop(self):
+        for key, value in self.shadowed.pop().items():
+            if value is unset:
+                del self.scope[key]
+            else:
+                self.scope[key] = value
+
+    @property
+    def depth(self):
+        return len(self.shadowed)
+
+    def copy(self):
+        data = DataStack()
+        data.layers = self.layers
+        data.scope = self.scope.copy()
+        data.shadowed = [frame.copy() for frame in self.shadowed]
+        return data
+
 
 # A Context object is a wrapper around the user's input data. Its `.resolve()` method contains
 # the lookup-logic for resolving dotted variable names.
 class Context:
 
     def __init__(self, data_dict, strict_mode):
-        # Stack of data dictionaries for the .resolve() method.
-        self.data = DataStack()
-
-        # Standard builtins.
-        self.data.stack.append({
-            'context': self,
-            'is_defined': self.is_defined,
-        })
-
-        # User-configurable builtins.
-        self.data.stack.append(builtins)
-
-        # Instance-specific data.
-        self.data.stack.append(data_dict)
+        # Scoped data for the .resolve() method. The first layer contains the standard builtins,
+        # followed by the user-configurable builtins and the instance-specific data.
+        self.data = DataStack(
+            {
+                'context': self,
+                'is_defined': self.is_defined,
+            },
+            builtins,
+            data_dict,
+        )
 
         # Nodes can store state information here to avoid threading issues.
         self.stash = {}
@@ -48,55 +105,97 @@ class Context:
         # Chain of ancestor templates.
         self.templates = []
 
+        # Maps block titles to the templates in the chain which define them.
+        self.block_table = {}
+
+        # Templates loaded by include tags during this render, keyed by name.
+        self.include_cache = {}
+
         # In strict mode undefined variables raise an UndefinedVariable exception.
         self.strict_mode = strict_mode
 
+        # Futures for awaitables resolved during an async render, keyed by awaitable ID.
+        self.awaitables = {}
+
+        # Variable lookups recorded for the render cache as (accessor, value) pairs, or None if
+        # lookups aren't being recorded. Lookups made through .resolve(), .get() and [] are all
+        # recorded; lookups of variables set in pushed scopes are skipped.
+        self.reads = None
+
+    # Returns a copy of the context with its own data stack for rendering a subtree concurrently
+    # with the rest of the template. All other state is shared.
+    def fork(self):
+        context = Context.__new__(Context)
+        context.__dict__.update(self.__dict__)
+        context.data = self.data.copy()
+        return context
+
     def __setitem__(self, key, value):
-        self.data.stack[-1][key] = value
+        self.data[key] = value
 
     def __getitem__(self, key):
-        return self.data[key]
+        if self.reads is None:
+            return self.data[key]
+        value = self.data.get(key, unset)
+        self.record_read(key, value)
+        if value is unset:
+            raise KeyError(key)
+        return value
 
     def push(self, data=None):
-        self.data.stack.append(data or {})
+        self.data.push()
+        if data:
+            self.update(data)
 
     def pop(self):
-        self.data.stack.pop()
+        self.data.pop()
 
     def get(self, key, default=None):
-        for d in reversed(self.data.stack):
-            if key in d:
-                return d[key]
-        return default
+        if self.reads is None:
+            return self.data.get(key, default)
+        value = self.data.get(key, unset)
+        self.record_read(key, value)
+        return default if value is unset else value
+
+    # Records a lookup made by a tag through .get() or [] for the render cache. Missing variables
+    # are recorded as undefined, matching the accessor's lookup when the cached output is checked.
+    def record_read(self, key, value):
+        if isinstance(key, str) and key not in self.data.scope:
+            self.reads.append((Accessor(key), Undefined() if value is unset else value))
 
     def update(self, data_dict):
-        self.data.stack[-1].update(data_dict)
+        for key, value in data_dict.items():
+            self.data[key] = value
 
     def resolve(self, varstring, token):
-        words = []
-        result = self.data
-        for word in varstring.split('.'):
-            words.append(word)
-            if hasattr(result, word):
-                result = getattr(result, word)
-            else:
-                try:
-                    result = result[word]
-                except:
-                    try:
-                        result = result[int(word)]
-                    except:
-                        if self.strict_mode:
-                            msg = f"Cannot resolve the variable '{'.'.join(words)}' in template "
-                            msg += f"'{token.template_id}', line {token.line_number}."
-                            raise errors.UndefinedVariable(msg, token) from None
-                        return Undefined()
-        return result
+        return Accessor(varstring).resolve(self, token)
+
+    # Like .resolve() but awaits any awaitable values encountered while resolving the variable.
+    async def resolve_async(self, varstring, token):
+        return await Accessor(varstring).resolve_async(self, token)
+
+    # Returns an Undefined instance or, in strict mode, raises an UndefinedVariable exception.
+    def undefined(self, varstring, token):
+        if self.strict_mode:
+            msg = f"Cannot resolve the variable '{varstring}' in template "
+            msg += f"'{token.template_id}', line {token.line_number}."
+            raise errors.UndefinedVariable(msg, token)
+        return Undefined()
+
+    # Awaits the value if it's awaitable, otherwise returns it unchanged. Each awaitable is
+    # awaited only once; its result is shared by every lookup and concurrent subtree.
+    async def await_value(self, obj):
+        if not inspect.isawaitable(obj):
+            return obj
+        key = id(obj)
+        if key not in self.awaitables:
+            self.awaitables[key] = (obj, asyncio.ensure_future(obj))
+        return await self.awaitables[key][1]
 
     def is_defined(self, varstring):
         current = self.data
         for word in varstring.split('.'):
-            if hasattr(current, word):
+            if current is not self.data and hasattr(current, word):
                 current = getattr(current, word)
             else:
                 try:
@@ -109,6 +208,132 @@ class Context:
         return True
 
 
+# Strategies recorded by an Accessor's inline caches.
+ATTR, KEY, INDEX = 'attr', 'key', 'index'
+
+
+# Types for which the outcome of hasattr() depends only on the type, not the instance. Key and
+# index strategies can only be cached for these types as they skip the hasattr() check.
+fixed_attribute_types = {}
+
+
+# A type's attributes are fixed if its instances have no __dict__, it doesn't customize attribute
+# access, and it defines no data descriptors --- slots and properties can raise AttributeError for
+# some instances and not others. Dunder attributes like __class__ are ignored.
+def has_fixed_attributes(cls):
+    if cls not in fixed_attribute_types:
+        fixed_attribute_types[cls] = (
+            cls.__dictoffset__ == 0
+            and not hasattr(cls, '__getattr__')
+            and isinstance(cls.__getattribute__, types.WrapperDescriptorType)
+            and not any(
+                is_data_descriptor(value)
+                for klass in cls.__mro__
+                for name, value in vars(klass).items()
+                if not (name.startswith('__') and name.endswith('__'))
+            )
+        )
+    return fixed_attribute_types[cls]
+
+
+def is_data_descriptor(obj):
+    return hasattr(type(obj), '__set__') or hasattr(type(obj), '__delete__')
+
+
+# A precompiled resolver for a dotted variable name. The name is split once when the accessor is
+# created. Each path segment has an inline cache which records, for each type observed at that
+# position, whether attribute, key, or index access succeeded, so repeated lookups try the
+# successful strategy first. A cache miss falls back to the standard lookup logic: try
+# attribute access, then key access, then integer index access.
+class Accessor:
+
+    def __init__(self, varstring):
+        self.varstring = varstring
+        self.words = varstring.split('.')
+        self.indexes = [self.parse_index(word) for word in self.words]
+        self.caches = [{} for word in self.words]
+
+    # The inline caches are rebuilt after unpickling as they may contain unpicklable types.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['caches'] = [{} for word in self.words]
+        return state
+
+    @staticmethod
+    def parse_index(word):
+        try:
+            return int(word)
+        except ValueError:
+            return None
+
+    def resolve(self, context, token):
+        try:
+            result = context.data[self.words[0]]
+        except KeyError:
+            result = context.undefined(self.words[0], token)
+        else:
+            for position in range(1, len(self.words)):
+                result = self.lookup(result, position)
+                if result is unset:
+                    result = context.undefined('.'.join(self.words[:position + 1]), token)
+                    break
+        if context.reads is not None and self.words[0] not in context.data.scope:
+            context.reads.append((self, result))
+        return result
+
+    async def resolve_async(self, context, token):
+        try:
+            result = context.data[self.words[0]]
+        except KeyError:
+            return context.undefined(self.words[0], token)
+        result = await context.await_value(result)
+        for position in range(1, len(self.words)):
+            result = self.lookup(result, position)
+            if result is unset:
+                return context.undefined('.'.join(self.words[:position + 1]), token)
+            result = await context.await_value(result)
+        return result
+
+    # Looks up the path segment at `position` on `obj`. Returns `unset` if the lookup fails.
+    def lookup(self, obj, position):
+        word = self.words[position]
+        cache = self.caches[position]
+        cls = type(obj)
+        strategy = cache.get(cls)
+
+        if strategy is ATTR:
+            try:
+                return getattr(obj, word)
+            except AttributeError:
+                pass
+        elif strategy is KEY:
+            try:
+                return obj[word]
+            except:
+                pass
+        elif strategy is INDEX:
+            try:
+                return obj[self.indexes[position]]
+            except:
+                pass
+
+        if hasattr(obj, word):
+            cache[cls] = ATTR
+            return getattr(obj, word)
+        try:
+            result = obj[word]
+            strategy = KEY
+        except:
+            try:
+                result = obj[int(word)]
+                strategy = INDEX
+            except:
+                return unset
+        if has_fixed_attributes(cls):
+            cache[cls] = strategy
+        return result
+
+
 # Null type returned when a context lookup fails.
 class Undefined:
 
@@ -50,3 +50,14 @@ class UndefinedVariable(TemplateError):
         super().__init__(msg)
         self.token = token
 
+
+# This exception type is raised by a loader's .precompile() method if any templates fail to load
+# or compile. Its `errors` attribute maps the name of each failed template to its exception.
+class PrecompileError(TemplateLoadError):
+
+    def __init__(self, errors):
+        msg = f"{len(errors)} template(s) failed to compile:"
+        for name, err in errors.items():
+            msg += f"\n  {err}"
+        super().__init__(msg)
+        self.errors = errors
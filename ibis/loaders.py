@@ -1,7 +1,303 @@
+import gc
 import os
+import sys
+import time
+import types
+import fnmatch
+import itertools
+import concurrent.futures
+import hashlib
+import pickle
+import tempfile
+import threading
+import collections
+import ibis
 
 from .template import Template
-from .errors import TemplateLoadError
+from .errors import TemplateLoadError, PrecompileError
+
+
+# Stores compiled templates on disk so they can be reused by other processes without being
+# recompiled. Entries are keyed by the template's path, mtime, and size, the library version,
+# and the tag delimiters, so stale entries are never matched. Corrupt or unreadable entries are
+# ignored. Entries are pickled so the cache directory must not be writable by untrusted users.
+class DiskCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Returns the cache key for a template file. The key should be computed before the file is
+    # read so an entry can never be stored against the metadata of a newer version of the file.
+    def key(self, path, template_id):
+        stat = os.stat(path)
+        delimiters = (
+            ibis.compiler.comment_start, ibis.compiler.comment_end,
+            ibis.compiler.print_start, ibis.compiler.print_end,
+            ibis.compiler.eprint_start, ibis.compiler.eprint_end,
+            ibis.compiler.instruction_start, ibis.compiler.instruction_end,
+        )
+        return (
+            os.path.abspath(path),
+            template_id,
+            stat.st_mtime_ns,
+            stat.st_size,
+            ibis.__version__,
+            delimiters,
+        )
+
+    def entry_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.ibiscache")
+
+    # Returns the cached Template for the key or None if there is no valid entry.
+    def load(self, key):
+        try:
+            with open(self.entry_path(key), 'rb') as file:
+                entry_key, root_node = pickle.load(file)
+        except Exception:
+            return None
+        if entry_key != key:
+            return None
+        return Template.from_root_node(root_node, key[1])
+
+    # Writes the template's node tree to the cache. Failures are ignored as the cache is only
+    # an optimization.
+    def save(self, key, template):
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((key, template.root_node), file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.entry_path(key))
+        except Exception:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+# An LRU cache of compiled templates used by the loaders. The cache can be bounded by its number of
+# entries and by the approximate memory used by the cached templates; the least recently used
+# templates are evicted when either limit is exceeded. The `sizeof` callable estimates the memory
+# used by a cached value; sizes are only estimated if `max_bytes` is set.
+#
+# The cache also records the loader's statistics --- hits, misses, compiles, evictions and the
+# total compile time in seconds --- which are reported by the loader's .stats() method.
+#
+# The cache is thread-safe. Loaders use .single_flight() to load missing templates so concurrent
+# requests for the same template only compile it once.
+class TemplateCache:
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or template_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.counters = collections.Counter()
+        self.compile_time = 0.0
+        self.lock = threading.RLock()
+        self.flights = {}
+        self.versions = {}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.entries[key][0]
+            self.entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self.lock:
+            self.pop(key)
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.entries and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)
+            ):
+                self.pop(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+
+    # Stores the value along with the version of the source it was compiled from, e.g. a file's
+    # mtime. Returns true if a value compiled from a different version was stored for the key
+    # before, even if it has since been evicted, i.e. if values still in use may be stale. A
+    # version is kept for each key until .forget() is called, so recompiling an evicted value from
+    # unchanged source returns false.
+    def store(self, key, value, version):
+        with self.lock:
+            changed = key in self.versions and self.versions[key] != version
+            self.versions[key] = version
+            self[key] = value
+            return changed
+
+    # Removes the key's value and version. Returns true if a value had been stored for the key.
+    def forget(self, key):
+        with self.lock:
+            self.pop(key)
+            return self.versions.pop(key, None) is not None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    # Like .get() but doesn't mark the entry as recently used.
+    def peek(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+        return default if entry is None else entry[0]
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                value, size = self.entries.pop(key)
+                self.size -= size
+                return value
+            return default
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Calls `func()` and returns its result. If another thread is already calling a function for
+    # the same key, waits for that call to finish instead and returns its result or raises its
+    # exception. The function should check the cache before loading, as the cache may have been
+    # updated by a call which finished just before this one started.
+    def single_flight(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            # A recursive call from the thread making the original call can't wait for it.
+            return func() if flight.owner == threading.get_ident() else flight.wait()
+        try:
+            flight.result = func()
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    # Compiles a template string, recording the compile and its duration.
+    def compile(self, template_string, template_id):
+        start = time.perf_counter()
+        template = Template(template_string, template_id)
+        with self.lock:
+            self.compile_time += time.perf_counter() - start
+            self.counters['compiles'] += 1
+        return template
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'compiles': self.counters['compiles'],
+                'evictions': self.counters['evictions'],
+                'compile_time': self.compile_time,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+
+# A call in progress for TemplateCache.single_flight().
+class Flight:
+
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+# Prepares the current loader's templates to be shared with worker processes forked from this
+# process, e.g. by a preforking server. Forked workers share the parent's memory pages until
+# either process writes to them, so the templates should be fully initialized before forking.
+#
+# Loads every template matching the glob `pattern` into `ibis.loader` --- using .precompile() if
+# the loader supports it, or matching the names in its `template_strings` dictionary --- and
+# computes the state which would otherwise be computed on first render (see Template.prepare()).
+# For other loaders, pass the template names to load as `names`; `pattern` is then ignored. If `freeze` is true the garbage collector is run and all
+# surviving objects are moved to a permanent generation using gc.freeze() so collections in the
+# workers don't write to the pages holding the templates. Rendering a template in a worker still
+# writes to its objects' reference counts and the inline caches of its variable lookups, so the
+# pages holding the templates a worker renders are copied. Returns the list of template names.
+def warmup(pattern='*', workers=None, freeze=True, names=None):
+    loader = ibis.loader
+    if names is not None:
+        names = list(names)
+    elif hasattr(loader, 'precompile'):
+        names = loader.precompile(pattern, workers)
+    elif hasattr(loader, 'template_strings'):
+        names = [name for name in loader.template_strings if fnmatch.fnmatch(name, pattern)]
+    else:
+        msg = "warmup() requires the template names to load, as the loader has neither a "
+        msg += "precompile() method nor a template_strings dictionary."
+        raise TypeError(msg)
+    templates = [loader(name) for name in names]
+
+    # Reloading a template while preparing another advances the loader's generation, which
+    # invalidates the state already prepared, so repeat until the generation is stable.
+    while True:
+        generation = getattr(loader, 'generation', None)
+        for template in templates:
+            template.prepare()
+        if getattr(loader, 'generation', None) == generation:
+            break
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return names
+
+
+# Returns the approximate memory in bytes used by a template's node tree. Templates linked to the
+# tree by include tags aren't counted.
+def template_size(template):
+    size, stack, seen = sys.getsizeof(template), [template.root_node], set()
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, Template, types.FunctionType,
+                types.BuiltinFunctionType, types.ModuleType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+            stack.extend(obj.__dict__.values())
+    return size
 
 
 # Loads templates from the file system. Assumes files are utf-8 encoded. Compiled templates are
@@ -23,80 +319,488 @@ from .errors import TemplateLoadError
 #     template = loader('foo.txt')
 #     template = loader('subdir/foo.txt')
 #
+# If a `cache_dir` is specified, compiled templates are also cached on disk so they can be
+# reused by other processes and across restarts:
+#
+#     loader = FileLoader('/path/to/base/dir', cache_dir='/path/to/cache/dir')
+#
+# If `index` is true the loader indexes all files under its base directories when it's created,
+# so templates can be located without touching the file system at all. Missing template names are
+# also remembered. Call .reindex() to pick up templates added since the loader was created.
+#
+#     loader = FileLoader('/path/to/base/dir', index=True)
+#
+# Without an index, specify a `miss_ttl` in seconds to remember missing template names for that
+# long, so repeated lookups for a missing template don't touch the file system. Templates created
+# in the meantime aren't found until the name expires or .reindex() is called.
+#
+#     loader = FileLoader('/path/to/base/dir', miss_ttl=10)
+#
+# The in-memory cache is unbounded by default. Specify `max_entries` and/or `max_bytes` to limit
+# the number of cached templates and their approximate memory; least recently used templates are
+# evicted and recompiled if they're needed again. The .stats() method reports hits, misses,
+# compiles, evictions, and the total compile time.
+#
+# The loader is thread-safe. If several threads request a template which isn't cached, one thread
+# loads it and the others wait for the result.
 class FileLoader:
 
-    def __init__(self, *base_dirs):
+    # Maximum number of missing template names to remember.
+    max_misses = 1024
+
+    def __init__(self, *base_dirs, cache_dir=None, max_entries=None, max_bytes=None,
+                 index=False, miss_ttl=None):
         self.base_dirs = base_dirs
-        self.cache = {}
+        self.cache = TemplateCache(max_entries, max_bytes)
+        self.disk_cache = DiskCache(cache_dir) if cache_dir else None
+        self.generation = 0
+        self.index = build_index(base_dirs) if index else None
+        self.miss_ttl = miss_ttl
+        self.missing = collections.OrderedDict()
 
     def __call__(self, filename):
-        if filename in self.cache:
-            return self.cache[filename]
+        if (template := self.cache.get(filename)) is not None:
+            self.cache.count('hits')
+            return template
+
+        self.cache.count('misses')
+        return self.cache.single_flight(filename, lambda: self.find(filename))
+
+    # Locates and loads a template which wasn't found in the cache.
+    def find(self, filename):
+        if (template := self.cache.peek(filename)) is not None:
+            return template
+        if not self.is_missing(filename):
+            if path := self.locate(filename):
+                return self.load(filename, path)
+            self.remember_missing(filename)
+
+        msg = f"FileLoader cannot locate the template file '{filename}'."
+        raise TemplateLoadError(msg)
 
+    # Returns true if the template name is remembered as missing. Entries in `missing` map names
+    # to their expiry times, or to None if they're remembered until the loader is reindexed.
+    def is_missing(self, filename):
+        with self.cache.lock:
+            if filename not in self.missing:
+                return False
+            expires = self.missing[filename]
+            if expires is None or expires > time.monotonic():
+                return True
+            del self.missing[filename]
+            return False
+
+    def remember_missing(self, filename):
+        if self.index is None and self.miss_ttl is None:
+            return
+        expires = None if self.index is not None else time.monotonic() + self.miss_ttl
+        with self.cache.lock:
+            self.missing[filename] = expires
+            if len(self.missing) > self.max_misses:
+                self.missing.popitem(last=False)
+
+    # Returns the path of the template file in the first base directory containing it.
+    def locate(self, filename):
+        if self.index is not None:
+            if path := self.index.get(filename):
+                return path
+            return self.index.get(os.path.normpath(filename).replace(os.sep, '/'))
         for base_dir in self.base_dirs:
             path = os.path.join(base_dir, filename)
             if os.path.isfile(path):
-                try:
-                    with open(path, encoding='utf-8') as file:
-                        template_string = file.read()
-                except OSError as err:
-                    msg = f"FileLoader cannot load the template file '{path}'."
-                    raise TemplateLoadError(msg) from err
-
-                template = Template(template_string, filename)
-                self.cache[filename] = template
-                return template
+                return path
+        return None
+
+    def load(self, filename, path):
+        try:
+            mtime = os.path.getmtime(path)
+            if self.disk_cache:
+                key = self.disk_cache.key(path, filename)
+                if template := self.disk_cache.load(key):
+                    self.store(filename, mtime, template)
+                    return template
+            with open(path, encoding='utf-8') as file:
+                template_string = file.read()
+        except OSError as err:
+            msg = f"FileLoader cannot load the template file '{path}'."
+            raise TemplateLoadError(msg) from err
+
+        template = self.cache.compile(template_string, filename)
+        if self.disk_cache:
+            self.disk_cache.save(key, template)
+        self.store(filename, mtime, template)
+        return template
+
+    # The generation is only advanced when the template's file has changed since it was last
+    # stored, so neither compiling a template for the first time nor recompiling an evicted
+    # template invalidates the state cached for other templates.
+    def store(self, filename, mtime, template):
+        with self.cache.lock:
+            if self.cache.store(filename, template, mtime):
+                self.generation += 1
+
+    # Compiles every template file under the base directories whose name matches the glob
+    # `pattern` and stores the templates in the cache (and the disk cache, if configured). See
+    # compile_files() for the `workers` argument. Returns a list of the compiled template names.
+    # If any templates fail to compile the remaining templates are still cached, then a
+    # PrecompileError listing all the failures is raised.
+    def precompile(self, pattern='*', workers=None):
+        index = self.index if self.index is not None else build_index(self.base_dirs)
+        paths = {name: path for name, path in index.items() if fnmatch.fnmatch(name, pattern)}
+        compiled, errors = compile_files(paths, self.disk_cache, workers)
+        for name, (mtime, template) in compiled.items():
+            self.store(name, mtime, template)
+        if errors:
+            raise PrecompileError(errors)
+        return list(compiled)
+
+    # Rebuilds the index, if enabled, and forgets missing template names so templates added
+    # since the loader was created can be found.
+    def reindex(self):
+        if self.index is not None:
+            self.index = build_index(self.base_dirs)
+        with self.cache.lock:
+            self.missing.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+# Compiles the template files in a dictionary mapping template names to paths. Returns a dictionary
+# mapping the name of each compiled template to an (mtime, template) tuple and a dictionary mapping
+# the name of each template which failed to load or compile to its exception.
+#
+# Templates are compiled in a pool of `workers` processes; the default is the number of CPUs. If
+# `workers` is 0 the templates are compiled in the current process. Note that custom tags and
+# filters must be registered when the worker processes import their modules for the workers to
+# recognise them, which isn't the case for processes started using the 'spawn' method unless
+# they're registered by an imported module.
+#
+# If a DiskCache is specified, templates are loaded from it where possible and newly compiled
+# templates are saved to it.
+def compile_files(paths, disk_cache=None, workers=None):
+    compiled, errors, pending = {}, {}, []
+    for name, path in paths.items():
+        try:
+            mtime = os.path.getmtime(path)
+            key = disk_cache.key(path, name) if disk_cache else None
+        except OSError as err:
+            errors[name] = TemplateLoadError(f"Cannot load the template file '{path}': {err}")
+            continue
+        if key and (template := disk_cache.load(key)):
+            compiled[name] = (mtime, template)
+        else:
+            pending.append((name, path, mtime, key))
+
+    delimiters = get_delimiters()
+    args = ([path for name, path, mtime, key in pending], [name for name, *_ in pending])
+    if workers == 0 or len(pending) < 2:
+        results = map(compile_file, *args, itertools.repeat(delimiters))
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+        chunksize = max(1, len(pending) // ((workers or os.cpu_count() or 1) * 4))
+        results = executor.map(compile_file, *args, itertools.repeat(delimiters), chunksize=chunksize)
+
+    try:
+        for (name, path, mtime, key), (root_node, err) in zip(pending, results):
+            if err:
+                errors[name] = err
+                continue
+            template = Template.from_root_node(root_node, name)
+            if disk_cache:
+                disk_cache.save(key, template)
+            compiled[name] = (mtime, template)
+    finally:
+        if executor:
+            executor.shutdown()
+    return compiled, errors
 
-        msg = f"FileLoader cannot locate the template file '{filename}'."
-        raise TemplateLoadError(msg)
+
+# Compiles a template file, returning a (root_node, error) tuple. Runs in a worker process.
+def compile_file(path, name, delimiters):
+    set_delimiters(delimiters)
+    try:
+        with open(path, encoding='utf-8') as file:
+            template_string = file.read()
+    except (OSError, UnicodeDecodeError) as err:
+        return None, TemplateLoadError(f"Cannot load the template file '{path}': {err}")
+    try:
+        return Template(template_string, name).root_node, None
+    except ibis.errors.TemplateError as err:
+        return None, err
+
+
+def get_delimiters():
+    return {name: getattr(ibis.compiler, name) for name in delimiter_names}
+
+
+def set_delimiters(delimiters):
+    for name, value in delimiters.items():
+        setattr(ibis.compiler, name, value)
+
+
+delimiter_names = (
+    'comment_start', 'comment_end', 'print_start', 'print_end',
+    'eprint_start', 'eprint_end', 'instruction_start', 'instruction_end',
+)
+
+
+# Returns a dictionary mapping the name of every file under the base directories, relative to its
+# base directory and using '/' separators, to its path. Files in earlier base directories take
+# priority. Symlinked directories are followed.
+def build_index(base_dirs):
+    index = {}
+    for base_dir in base_dirs:
+        visited = set()
+        for dirpath, dirnames, filenames in os.walk(base_dir, followlinks=True):
+            realpath = os.path.realpath(dirpath)
+            if realpath in visited:
+                dirnames.clear()
+                continue
+            visited.add(realpath)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, base_dir).replace(os.sep, '/')
+                index.setdefault(key, path)
+    return index
 
 
 # Like FileLoader but templates are automatically recompiled if the underlying template file
 # is modified.
+#
+# By default the loader checks the modification time of a template's file each time the template
+# is requested. Specify a `check_interval` in seconds to check each file at most once per
+# interval:
+#
+#     loader = FileReloader('/path/to/base/dir', check_interval=2)
+#
+# Alternatively, specify a `poll_interval` in seconds to check the files of all cached templates
+# from a background thread. Changed templates are recompiled by the thread and swapped into the
+# cache, so requests never check files or wait for recompilation. Call .close() to stop the
+# thread.
+#
+#     loader = FileReloader('/path/to/base/dir', poll_interval=1)
+#
+# The loader records each template's static dependencies, i.e. the templates it extends or
+# includes by literal name. When a template is checked its dependencies are also checked, so a
+# modified parent template or partial is reloaded without reloading anything else. The loader's
+# `generation` is incremented whenever a template is reloaded or discarded; templates depending on
+# it aren't recompiled, but their cached inheritance chains and include links are recomputed on
+# their next render. Dependencies which have been evicted from the cache are still checked, and
+# reloaded only if their files have changed.
+#
+# Like FileLoader, the loader is thread-safe and each template file is checked and reloaded by one
+# thread at a time; other threads requesting the template wait for the result.
 class FileReloader:
 
-    def __init__(self, *base_dirs):
+    def __init__(self, *base_dirs, cache_dir=None, max_entries=None, max_bytes=None,
+                 check_interval=0, poll_interval=None):
         self.base_dirs = base_dirs
-        self.cache = {}
+        self.cache = TemplateCache(max_entries, max_bytes, lambda entry: template_size(entry[1]))
+        self.disk_cache = DiskCache(cache_dir) if cache_dir else None
+        self.check_interval = check_interval
+        self.poll_interval = poll_interval
+        self.dependencies = {}
+        self.generation = 0
+        self.poller = None
+        if poll_interval is not None:
+            self.stop_polling = threading.Event()
+            self.poller = threading.Thread(target=self.poll, name='ibis-reloader', daemon=True)
+            self.poller.start()
 
+    # Cache entries are [mtime, template, checked] lists where `checked` is the time the file's
+    # mtime was last checked.
     def __call__(self, filename):
+        entry = self.cache.get(filename)
+        if entry is not None and (self.poller or self.is_fresh(entry)):
+            self.cache.count('hits')
+            return entry[1]
+
+        template = self.refresh(filename)
+        self.cache.count('hits' if entry is not None and template is entry[1] else 'misses')
+        for dependency in self.dependency_closure(filename):
+            self.recheck(dependency)
+        return template
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry[2] < self.check_interval
+
+    # Reloads the template if its file has changed, or discards it if it can no longer be loaded.
+    # Evicted templates are only reloaded if their files have changed since they were stored, as
+    # other templates may still be using them.
+    def recheck(self, filename):
+        entry = self.cache.peek(filename)
+        if entry is None and not self.is_modified(filename):
+            return
+        if entry is None or not self.is_fresh(entry):
+            try:
+                self.refresh(filename)
+            except (OSError, ibis.errors.TemplateError):
+                self.discard(filename)
+
+    # Returns true if the template was stored before and its file has since changed or been removed.
+    def is_modified(self, filename):
+        with self.cache.lock:
+            version = self.cache.versions.get(filename)
+        if version is None:
+            return False
+        try:
+            return os.path.getmtime(self.locate(filename) or '') != version
+        except OSError:
+            return True
+
+    # Checks the template file against the current cache entry, reloading the template if the file
+    # has changed. Concurrent calls for the same template share a single check.
+    def refresh(self, filename):
+        return self.cache.single_flight(filename, lambda: self.check(filename))
+
+    # Checks the template file's mtime and reloads the template if the file has changed.
+    def check(self, filename):
+        entry = self.cache.peek(filename)
+        if path := self.locate(filename):
+            mtime = os.path.getmtime(path)
+            if entry is not None and mtime == entry[0]:
+                entry[2] = time.monotonic()
+                return entry[1]
+            return self.load(filename, path, mtime)
+
+        msg = f"FileReloader cannot locate the template file '{filename}'."
+        raise TemplateLoadError(msg)
+
+    # Returns the path of the template file in the first base directory containing it.
+    def locate(self, filename):
         for base_dir in self.base_dirs:
             path = os.path.join(base_dir, filename)
             if os.path.isfile(path):
-                mtime = os.path.getmtime(path)
-                if filename in self.cache:
-                    if mtime == self.cache[filename][0]:
-                        return self.cache[filename][1]
-
-                try:
-                    with open(path, encoding='utf-8') as file:
-                        template_string = file.read()
-                except OSError as err:
-                    msg = f"FileReloader cannot load the template file '{path}'."
-                    raise TemplateLoadError(msg) from err
-
-                template = Template(template_string, filename)
-                self.cache[filename] = (mtime, template)
+                return path
+        return None
+
+    # Loads and compiles the template file, then stores the template in the cache.
+    def load(self, filename, path, mtime):
+        if self.disk_cache:
+            key = self.disk_cache.key(path, filename)
+            if template := self.disk_cache.load(key):
+                self.store(filename, mtime, template)
                 return template
 
-        msg = f"FileReloader cannot locate the template file '{filename}'."
-        raise TemplateLoadError(msg)
+        try:
+            with open(path, encoding='utf-8') as file:
+                template_string = file.read()
+        except OSError as err:
+            msg = f"FileReloader cannot load the template file '{path}'."
+            raise TemplateLoadError(msg) from err
+
+        template = self.cache.compile(template_string, filename)
+        if self.disk_cache:
+            self.disk_cache.save(key, template)
+        self.store(filename, mtime, template)
+        return template
+
+    # Like FileLoader.store(), the generation is only advanced when the template's file has changed.
+    def store(self, filename, mtime, template):
+        with self.cache.lock:
+            if self.cache.store(filename, [mtime, template, time.monotonic()], mtime):
+                self.generation += 1
+            self.set_dependencies(filename, template.dependencies())
+
+    # Removes a template which can no longer be loaded from the cache and dependency graph. The
+    # generation is advanced if the template had been loaded, even if it has since been evicted.
+    def discard(self, filename):
+        with self.cache.lock:
+            if self.cache.forget(filename):
+                self.generation += 1
+            self.set_dependencies(filename, set())
+
+    # Records the template's dependencies. The caller must hold the cache's lock.
+    def set_dependencies(self, filename, dependencies):
+        if dependencies:
+            self.dependencies[filename] = dependencies
+        else:
+            self.dependencies.pop(filename, None)
+
+    # Returns the names of the templates the template depends on, directly or indirectly.
+    def dependency_closure(self, filename):
+        found, stack = [], [filename]
+        with self.cache.lock:
+            while stack:
+                for name in self.dependencies.get(stack.pop(), ()):
+                    if name != filename and name not in found:
+                        found.append(name)
+                        stack.append(name)
+        return found
+
+    # Like FileLoader.precompile().
+    def precompile(self, pattern='*', workers=None):
+        index = build_index(self.base_dirs)
+        paths = {name: path for name, path in index.items() if fnmatch.fnmatch(name, pattern)}
+        compiled, errors = compile_files(paths, self.disk_cache, workers)
+        for name, (mtime, template) in compiled.items():
+            self.store(name, mtime, template)
+        if errors:
+            raise PrecompileError(errors)
+        return list(compiled)
+
+    def poll(self):
+        while not self.stop_polling.wait(self.poll_interval):
+            self.scan()
+
+    # Checks the files of all cached templates, and of evicted templates, and recompiles any which
+    # have changed. Templates whose files have been deleted or can no longer be compiled are
+    # dropped from the cache so the error is reported when the template is next requested.
+    def scan(self):
+        with self.cache.lock:
+            filenames = list(self.cache.versions)
+        for filename in filenames:
+            entry = self.cache.peek(filename)
+            if entry is None and not self.is_modified(filename):
+                continue
+            try:
+                self.refresh(filename)
+            except (OSError, ibis.errors.TemplateError):
+                self.discard(filename)
+
+    # Stops the background polling thread. The loader falls back to checking files on request.
+    def close(self):
+        if self.poller:
+            self.stop_polling.set()
+            self.poller.join()
+            self.poller = None
+
+    def stats(self):
+        return self.cache.stats()
 
 
 # Loads templates from a dictionary of template strings. Templates are compiled once and cached for
-# future use.
+# future use. As with FileLoader, the cache can be bounded using `max_entries` and `max_bytes`, and
+# the loader is thread-safe. The loader's `generation` is advanced if an evicted template is
+# recompiled from a changed string.
 class DictLoader:
 
-    def __init__(self, template_strings):
-        self.templates = {}
+    def __init__(self, template_strings, max_entries=None, max_bytes=None):
+        self.templates = TemplateCache(max_entries, max_bytes)
         self.template_strings = template_strings
+        self.generation = 0
 
     def __call__(self, name):
-        if name in self.templates:
-            return self.templates[name]
-        elif name in self.template_strings:
-            template = Template(self.template_strings[name], name)
-            self.templates[name] = template
+        if (template := self.templates.get(name)) is not None:
+            self.templates.count('hits')
+            return template
+        self.templates.count('misses')
+        return self.templates.single_flight(name, lambda: self.load(name))
+
+    def load(self, name):
+        if (template := self.templates.peek(name)) is not None:
+            return template
+        if name in self.template_strings:
+            template_string = self.template_strings[name]
+            template = self.templates.compile(template_string, name)
+            with self.templates.lock:
+                if self.templates.store(name, template, template_string):
+                    self.generation += 1
             return template
         msg = f"DictLoader has no entry matching the template name '{name}'."
         raise TemplateLoadError(msg)
+
+    def stats(self):
+        return self.templates.stats()
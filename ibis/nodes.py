@@ -1,13 +1,17 @@
 import ast
+import asyncio
+import hashlib
 import operator
 import re
 import itertools
 import collections
+import threading
 import ibis
 
 from . import utils
 from . import filters
 from . import errors
+from .context import Accessor
 
 
 # Dictionary of registered keywords for instruction tags.
@@ -75,6 +79,7 @@ class Expression:
             if not self.is_func_call and not self.re_varstring.match(expr):
                 msg = f"Unparsable expression '{expr}'."
                 raise errors.TemplateSyntaxError(msg, self.token) from None
+            self.accessor = Accessor(self.varstring)
 
     def _try_parse_as_func_call(self, expr):
         match = self.re_func_call.match(expr)
@@ -108,6 +113,16 @@ class Expression:
                 raise errors.TemplateSyntaxError(msg, self.token) from err
         return obj
 
+    # Filter functions are pickled by name and looked up in the filter registry when unpickled.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['filters'] = [(name, args) for name, func, args in self.filters]
+        return state
+
+    def __setstate__(self, state):
+        state['filters'] = [(name, filters.filtermap[name], args) for name, args in state['filters']]
+        self.__dict__.update(state)
+
     def eval(self, context):
         if self.is_literal:
             return self.literal
@@ -115,15 +130,33 @@ class Expression:
             return self._resolve_variable(context)
 
     def _resolve_variable(self, context):
-        obj = context.resolve(self.varstring, self.token)
+        obj = self.accessor.resolve(context, self.token)
         if self.is_func_call:
+            obj = self._call_function(obj)
+        return self._apply_filters_to_variable(obj)
+
+    # Like .eval() but awaits any awaitables encountered while resolving the variable, including
+    # the return value of a function call.
+    async def eval_async(self, context):
+        if self.is_literal:
+            return self.literal
+        obj = await self.accessor.resolve_async(context, self.token)
+        if self.is_func_call:
+            obj = self._call_function(obj)
             try:
-                obj = obj(*self.func_args)
+                obj = await context.await_value(obj)
             except Exception as err:
                 msg = f"Error calling function '{self.varstring}'."
                 raise errors.TemplateRenderingError(msg, self.token) from err
         return self._apply_filters_to_variable(obj)
 
+    def _call_function(self, obj):
+        try:
+            return obj(*self.func_args)
+        except Exception as err:
+            msg = f"Error calling function '{self.varstring}'."
+            raise errors.TemplateRenderingError(msg, self.token) from err
+
     def _apply_filters_to_variable(self, obj):
         for name, func, args in self.filters:
             try:
@@ -137,6 +170,14 @@ class Expression:
 # Base class for all node objects. To render a node into a string call its .render() method.
 # Subclasses shouldn't override the base .render() method; instead they should override
 # .wrender() which ensures that any uncaught exceptions are wrapped in a TemplateRenderingError.
+#
+# To render a node incrementally call its .stream() method which returns a generator of output
+# chunks. Subclasses can override .wstream() to yield their output incrementally; by default a
+# node which overrides .wrender() yields its rendered output as a single chunk.
+#
+# Similarly, .render_async() renders a node in an async context, awaiting awaitable values on
+# demand. Subclasses can override .wrender_async(); by default a node which overrides .wrender()
+# is rendered synchronously.
 class Node:
 
     def __init__(self, token=None, children=None):
@@ -170,17 +211,49 @@ class Node:
         except errors.TemplateError:
             raise
         except Exception as err:
-            if self.token:
-                tagname = f"'{self.token.keyword}'" if self.token.type == "INSTRUCTION" else self.token.type
-                msg = f"An unexpected error occurred while rendering the {tagname} tag: "
-                msg += f"{err.__class__.__name__}: {err}"
-            else:
-                msg = f"Unexpected rendering error: {err.__class__.__name__}: {err}"
-            raise errors.TemplateRenderingError(msg, self.token) from err
+            raise self.rendering_error(err) from err
+
+    # Wraps an unexpected exception raised while rendering the node in a TemplateRenderingError.
+    def rendering_error(self, err):
+        if self.token:
+            tagname = f"'{self.token.keyword}'" if self.token.type == "INSTRUCTION" else self.token.type
+            msg = f"An unexpected error occurred while rendering the {tagname} tag: "
+            msg += f"{err.__class__.__name__}: {err}"
+        else:
+            msg = f"Unexpected rendering error: {err.__class__.__name__}: {err}"
+        return errors.TemplateRenderingError(msg, self.token)
 
     def wrender(self, context):
         return ''.join(child.render(context) for child in self.children)
 
+    def stream(self, context):
+        try:
+            yield from self.wstream(context)
+        except errors.TemplateError:
+            raise
+        except Exception as err:
+            raise self.rendering_error(err) from err
+
+    def wstream(self, context):
+        if type(self).wrender is Node.wrender:
+            for child in self.children:
+                yield from child.stream(context)
+        else:
+            yield self.wrender(context)
+
+    async def render_async(self, context):
+        try:
+            return await self.wrender_async(context)
+        except errors.TemplateError:
+            raise
+        except Exception as err:
+            raise self.rendering_error(err) from err
+
+    async def wrender_async(self, context):
+        if type(self).wrender is Node.wrender:
+            return await render_nodes_async(self.children, context)
+        return self.wrender(context)
+
     def process_token(self, token):
         pass
 
@@ -194,6 +267,26 @@ class Node:
         return self.children, None, []
 
 
+# Renders a list of nodes asynchronously. Include tags are rendered concurrently with the nodes
+# that follow them using forked contexts, so their awaitables are resolved concurrently.
+async def render_nodes_async(node_list, context):
+    output = []
+    try:
+        for node in node_list:
+            if isinstance(node, IncludeNode):
+                output.append(asyncio.ensure_future(node.render_async(context.fork())))
+            else:
+                output.append(await node.render_async(context))
+        for index, chunk in enumerate(output):
+            if isinstance(chunk, asyncio.Future):
+                output[index] = await chunk
+    finally:
+        for chunk in output:
+            if isinstance(chunk, asyncio.Future):
+                chunk.cancel()
+    return ''.join(output)
+
+
 # TextNodes represent ordinary template text, i.e. text not enclosed in tag delimiters.
 class TextNode(Node):
 
@@ -240,6 +333,22 @@ class PrintNode(Node):
                 content = expr.eval(context)
                 if content:
                     break
+        return self.format(content)
+
+    async def wrender_async(self, context):
+        if self.is_ternary:
+            if await self.test_expr.eval_async(context):
+                content = await self.true_branch_expr.eval_async(context)
+            else:
+                content = await self.false_branch_expr.eval_async(context)
+        else:
+            for expr in self.exprs:
+                content = await expr.eval_async(context)
+                if content:
+                    break
+        return self.format(content)
+
+    def format(self, content):
         return filters.escape(str(content)) if self.token.type == "EPRINT" else str(content)
 
 
@@ -267,40 +376,176 @@ class ForNode(Node):
     def wrender(self, context):
         collection = self.expr.eval(context)
         if collection and hasattr(collection, '__iter__'):
-            collection = list(collection)
-            length = len(collection)
-            unpack = len(self.loopvars) > 1
             output = []
-            for index, item in enumerate(collection):
-                context.push()
-                if unpack:
-                    try:
-                        unpacked = dict(zip(self.loopvars, item))
-                    except Exception as err:
-                        msg = f"Unpacking error."
-                        raise errors.TemplateRenderingError(msg, self.token) from err
-                    else:
-                        context.update(unpacked)
-                else:
-                    context[self.loopvars[0]] = item
-                context['loop'] = {
-                    'index': index,
-                    'count': index + 1,
-                    'length': length,
-                    'is_first': index == 0,
-                    'is_last': index == length - 1,
-                    'parent': context.get('loop'),
-                }
+            for _ in self.iterate(context, collection):
                 output.append(self.for_branch.render(context))
-                context.pop()
             return ''.join(output)
         else:
             return self.empty_branch.render(context)
 
+    def wstream(self, context):
+        collection = self.expr.eval(context)
+        if collection and hasattr(collection, '__iter__'):
+            for _ in self.iterate(context, collection):
+                yield from self.for_branch.stream(context)
+        else:
+            yield from self.empty_branch.stream(context)
+
+    # Async rendering also supports looping over async iterables.
+    async def wrender_async(self, context):
+        collection = await self.expr.eval_async(context)
+        if hasattr(collection, '__aiter__'):
+            collection = [item async for item in collection]
+        if collection and hasattr(collection, '__iter__'):
+            output = []
+            for _ in self.iterate(context, collection):
+                output.append(await self.for_branch.render_async(context))
+            return ''.join(output)
+        else:
+            return await self.empty_branch.render_async(context)
+
+    # Sets the loop variables in a single context frame for each item in the collection, yielding
+    # to the caller to render the loop body. Sized collections are copied as before; other
+    # iterables are consumed lazily. The `loop` variable is only created if the loop body might
+    # reference it.
+    def iterate(self, context, collection):
+        if hasattr(collection, '__len__'):
+            collection = list(collection)
+        context.push()
+        if self.uses_loop:
+            collection = Loop(collection, context.get('loop'))
+            context['loop'] = collection
+        if len(self.loopvars) > 1:
+            for item in collection:
+                self.unpack(context, item)
+                yield
+        else:
+            loopvar = self.loopvars[0]
+            for item in collection:
+                context[loopvar] = item
+                yield
+        context.pop()
+
+    def unpack(self, context, item):
+        try:
+            unpacked = dict(zip(self.loopvars, item))
+        except Exception as err:
+            msg = f"Unpacking error."
+            raise errors.TemplateRenderingError(msg, self.token) from err
+        if len(unpacked) < len(self.loopvars):
+            # Clear any variables left over from the previous item.
+            loop = context.get('loop')
+            context.pop()
+            context.push()
+            if self.uses_loop:
+                context['loop'] = loop
+        context.update(unpacked)
+
     def exit_scope(self):
         for_nodes, _, empty_nodes = self.split_children(EmptyNode)
         self.for_branch = Node(None, for_nodes)
         self.empty_branch = Node(None, empty_nodes)
+        self.uses_loop = any(may_reference_loop(node, set()) for node in for_nodes)
+
+
+# The `loop` variable available inside a for loop. The loop object is reused for every iteration.
+# Its attributes are computed on demand --- in particular, the length of an iterable without a
+# known size is only computed (by buffering its remaining items) if the template asks for it.
+class Loop:
+
+    __slots__ = ('index', 'parent', 'items', 'buffer', 'size')
+
+    def __init__(self, collection, parent):
+        self.index = -1
+        self.parent = parent
+        self.items = iter(collection)
+        self.buffer = collections.deque()
+        self.size = len(collection) if isinstance(collection, list) else None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.buffer.popleft() if self.buffer else next(self.items)
+        self.index += 1
+        return item
+
+    # Supports dictionary-style access for backwards compatibility.
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    # Prints like the dictionary which used to represent the loop variable.
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def as_dict(self):
+        return {
+            'index': self.index,
+            'count': self.count,
+            'length': self.length,
+            'is_first': self.is_first,
+            'is_last': self.is_last,
+            'parent': self.parent.as_dict() if isinstance(self.parent, Loop) else self.parent,
+        }
+
+    @property
+    def count(self):
+        return self.index + 1
+
+    @property
+    def length(self):
+        if self.size is None:
+            self.buffer.extend(self.items)
+            self.size = self.index + 1 + len(self.buffer)
+        return self.size
+
+    @property
+    def is_first(self):
+        return self.index == 0
+
+    @property
+    def is_last(self):
+        if self.size is not None:
+            return self.index == self.size - 1
+        if not self.buffer:
+            try:
+                self.buffer.append(next(self.items))
+            except StopIteration:
+                return True
+        return False
+
+
+# Variable names through which a template can access the `loop` variable.
+loop_access_names = {'loop', 'context', 'is_defined', 'super'}
+
+
+# Returns true if rendering the node might access the `loop` variable. Include and block tags
+# render content from other templates and custom tags are opaque, so these are assumed to.
+def may_reference_loop(node, visited):
+    if id(node) in visited:
+        return False
+    visited.add(id(node))
+    if type(node) not in loop_analysable_node_types:
+        return True
+    for value in node.__dict__.values():
+        if may_reference_loop_in_value(value, visited):
+            return True
+    return False
+
+
+def may_reference_loop_in_value(value, visited):
+    if isinstance(value, Expression):
+        return not value.is_literal and value.accessor.words[0] in loop_access_names
+    elif isinstance(value, Node):
+        return may_reference_loop(value, visited)
+    elif isinstance(value, (list, tuple)):
+        return any(may_reference_loop_in_value(item, visited) for item in value)
+    elif isinstance(value, dict):
+        return any(may_reference_loop_in_value(item, visited) for item in value.values())
+    return False
 
 
 # Delimiter node to implement for/empty branching.
@@ -363,6 +608,26 @@ class IfNode(Node):
             for or_block in utils.splitre(conditions, (r'\s+or\s+', r'\|\|'))
         ]
 
+    # Conditions are pickled as plain tuples with operators stored by name.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        names = {op: name for name, op in self.operators.items()}
+        state['condition_groups'] = [
+            [(c.negated, c.lhs, names.get(c.op, c.op), c.rhs) for c in condition_group]
+            for condition_group in self.condition_groups
+        ]
+        return state
+
+    def __setstate__(self, state):
+        state['condition_groups'] = [
+            [
+                self.condition(negated, lhs, self.operators.get(op, op), rhs)
+                for negated, lhs, op, rhs in condition_group
+            ]
+            for condition_group in state['condition_groups']
+        ]
+        self.__dict__.update(state)
+
     def parse_condition(self, condstr):
         match = self.re_condition.match(condstr)
         if match.group(2):
@@ -394,7 +659,41 @@ class IfNode(Node):
             result = not result
         return result
 
+    async def eval_condition_async(self, cond, context):
+        try:
+            if cond.op:
+                lhs = await cond.lhs.eval_async(context)
+                result = cond.op(lhs, await cond.rhs.eval_async(context))
+            else:
+                result = operator.truth(await cond.lhs.eval_async(context))
+        except Exception as err:
+            msg = f"An exception was raised while evaluating the condition in the "
+            msg += f"'{self.tag}' tag."
+            raise errors.TemplateRenderingError(msg, self.token) from err
+        if cond.negated:
+            result = not result
+        return result
+
     def wrender(self, context):
+        return self.select_branch(context).render(context)
+
+    async def wrender_async(self, context):
+        for condition_group in self.condition_groups:
+            for condition in condition_group:
+                is_true = await self.eval_condition_async(condition, context)
+                if not is_true:
+                    break
+            if is_true:
+                break
+        if is_true:
+            return await self.true_branch.render_async(context)
+        else:
+            return await self.false_branch.render_async(context)
+
+    def wstream(self, context):
+        yield from self.select_branch(context).stream(context)
+
+    def select_branch(self, context):
         for condition_group in self.condition_groups:
             for condition in condition_group:
                 is_true = self.eval_condition(condition, context)
@@ -403,9 +702,9 @@ class IfNode(Node):
             if is_true:
                 break
         if is_true:
-            return self.true_branch.render(context)
+            return self.true_branch
         else:
-            return self.false_branch.render(context)
+            return self.false_branch
 
     def exit_scope(self):
         if_nodes, elif_node, elif_nodes = self.split_children(ElifNode)
@@ -456,13 +755,23 @@ class CycleNode(Node):
         # We store our state info on the context object to avoid a threading mess if
         # the template is being simultaneously rendered by multiple threads.
         if not self in context.stash:
-            items = self.expr.eval(context)
-            if not hasattr(items, '__iter__'):
-                items = ''
-            context.stash[self] = itertools.cycle(items)
+            self.start_cycle(context, self.expr.eval(context))
+        iterator = context.stash[self]
+        return str(next(iterator, ''))
+
+    async def wrender_async(self, context):
+        if not self in context.stash:
+            items = await self.expr.eval_async(context)
+            if not self in context.stash:
+                self.start_cycle(context, items)
         iterator = context.stash[self]
         return str(next(iterator, ''))
 
+    def start_cycle(self, context, items):
+        if not hasattr(items, '__iter__'):
+            items = ''
+        context.stash[self] = itertools.cycle(items)
+
 
 # IncludeNodes include a sub-template.
 #
@@ -474,10 +783,16 @@ class CycleNode(Node):
 #
 # Requires a template name which can be supplied as either a string literal or a variable
 # resolving to a string. This name will be passed to the registered template loader.
+#
+# If the name is a string literal the loaded template is linked to the node and reused until the
+# loader's `generation` changes. Otherwise loaded templates are cached for the rest of the render
+# so each distinct template is only loaded once per render. If `collect_include_stats` is set,
+# loader calls and cache hits are counted in `include_stats`.
 @register('include')
 class IncludeNode(Node):
 
     def process_token(self, token):
+        self.linked = None
         self.variables = {}
         parts = utils.splitre(token.text[7:], ["with"])
         if len(parts) == 1:
@@ -496,17 +811,58 @@ class IncludeNode(Node):
         else:
             raise errors.TemplateSyntaxError("Malformed 'include' tag.", token)
 
+    # The linked template is dropped when pickling; it's relinked on demand.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['linked'] = None
+        return state
+
     def wrender(self, context):
-        template_name = self.template_expr.eval(context)
+        template = self.load_template(self.template_expr.eval(context), context)
+        context.push()
+        for name, expr in self.variables.items():
+            context[name] = expr.eval(context)
+        rendered = template.root_node.render(context)
+        context.pop()
+        return rendered
+
+    def wstream(self, context):
+        template = self.load_template(self.template_expr.eval(context), context)
+        context.push()
+        for name, expr in self.variables.items():
+            context[name] = expr.eval(context)
+        yield from template.root_node.stream(context)
+        context.pop()
+
+    async def wrender_async(self, context):
+        template = self.load_template(await self.template_expr.eval_async(context), context)
+        context.push()
+        for name, expr in self.variables.items():
+            context[name] = await expr.eval_async(context)
+        rendered = await template.root_node.render_async(context)
+        context.pop()
+        return rendered
+
+    def load_template(self, template_name, context):
         if isinstance(template_name, str):
-            if ibis.loader:
-                template = ibis.loader(template_name)
-                context.push()
-                for name, expr in self.variables.items():
-                    context[name] = expr.eval(context)
-                rendered = template.root_node.render(context)
-                context.pop()
-                return rendered
+            if loader := ibis.loader:
+                if self.template_expr.is_literal and (linked := self.linked):
+                    if linked[0] is loader and linked[1] == getattr(loader, 'generation', None):
+                        if collect_include_stats:
+                            count_include('linked_hits')
+                        return linked[2]
+                if template := context.include_cache.get(template_name):
+                    if collect_include_stats:
+                        count_include('cache_hits')
+                    return template
+                if self.template_expr.is_literal and hasattr(loader, 'generation'):
+                    template = self.link(loader, template_name)
+                else:
+                    template = loader(template_name)
+                if collect_include_stats:
+                    count_include('loader_calls')
+                context.include_cache[template_name] = template
+                return template
             else:
                 msg = f"No template loader has been specified. "
                 msg += f"A template loader is required by the 'include' tag in "
@@ -518,6 +874,31 @@ class IncludeNode(Node):
             msg += f"This variable has the value: {repr(template_name)}."
             raise errors.TemplateRenderingError(msg, self.token)
 
+    # Loads the template and links it to the include tag. The link is only recorded against a
+    # generation which didn't change while the loader was called, so a template which was replaced
+    # in the meantime, e.g. by another thread, is never linked. If the generation changed the
+    # template is loaded again, up to three times.
+    def link(self, loader, template_name):
+        for _ in range(3):
+            generation = loader.generation
+            template = loader(template_name)
+            if loader.generation == generation:
+                self.linked = (loader, generation, template)
+                break
+        return template
+
+
+# Counters for the include tag's template lookups. Counting is disabled by default as the counters
+# are shared by every thread rendering templates; set `collect_include_stats` to True to enable it.
+collect_include_stats = False
+include_stats = collections.Counter()
+include_stats_lock = threading.Lock()
+
+
+def count_include(name):
+    with include_stats_lock:
+        include_stats[name] += 1
+
 
 # ExtendsNodes implement template inheritance. They indicate that the current template inherits
 # from or 'extends' the specified parent template.
@@ -554,11 +935,35 @@ class BlockNode(Node):
         self.title = token.text[5:].strip()
 
     def wrender(self, context):
-        block_list = []
-        for template in context.templates:
-            if block_node := template.blocks.get(self.title):
-                block_list.append(block_node)
-        return self.render_block(context, block_list)
+        return self.render_block(context, self.get_block_list(context))
+
+    def wstream(self, context):
+        block_list = self.get_block_list(context)
+        if block_list:
+            current_block = block_list.pop(0)
+            context.push()
+            context['super'] = lambda: self.render_block(context, block_list)
+            for child in current_block.children:
+                yield from child.stream(context)
+            context.pop()
+
+    async def wrender_async(self, context):
+        return await self.render_block_async(context, self.get_block_list(context))
+
+    # In async mode super() returns an awaitable which is awaited by the calling expression.
+    async def render_block_async(self, context, block_list):
+        if block_list:
+            current_block = block_list.pop(0)
+            context.push()
+            context['super'] = lambda: self.render_block_async(context, block_list)
+            output = await render_nodes_async(current_block.children, context)
+            context.pop()
+            return output
+        else:
+            return ''
+
+    def get_block_list(self, context):
+        return [template.blocks[self.title] for template in context.block_table.get(self.title, ())]
 
     def render_block(self, context, block_list):
         if block_list:
@@ -580,6 +985,10 @@ class SpacelessNode(Node):
         output = ''.join(child.render(context) for child in self.children)
         return filters.spaceless(output).strip()
 
+    async def wrender_async(self, context):
+        output = await render_nodes_async(self.children, context)
+        return filters.spaceless(output).strip()
+
 
 # Trims leading and trailing whitespace.
 @register('trim', 'endtrim')
@@ -588,6 +997,9 @@ class TrimNode(Node):
     def wrender(self, context):
         return ''.join(child.render(context) for child in self.children).strip()
 
+    async def wrender_async(self, context):
+        return (await render_nodes_async(self.children, context)).strip()
+
 
 # Caches a complex expression under a simpler alias.
 #
@@ -615,3 +1027,108 @@ class WithNode(Node):
         rendered = ''.join(child.render(context) for child in self.children)
         context.pop()
         return rendered
+
+    def wstream(self, context):
+        context.push()
+        for name, expr in self.variables.items():
+            context[name] = expr.eval(context)
+        for child in self.children:
+            yield from child.stream(context)
+        context.pop()
+
+    async def wrender_async(self, context):
+        context.push()
+        for name, expr in self.variables.items():
+            context[name] = await expr.eval_async(context)
+        rendered = await render_nodes_async(self.children, context)
+        context.pop()
+        return rendered
+
+
+# Caches a rendered fragment of template content in the `ibis.cache` fragment cache.
+#
+#    {% cache <key-expr> %} ... {% endcache %}
+#
+#    {% cache <key-expr>, <key-expr> <ttl-expr> %} ... {% endcache %}
+#
+# Multiple comma-separated key expressions are combined into a tuple key. The key is prefixed with
+# the tag's fragment ID --- the template ID, the tag's line number, and a digest of the block's
+# source --- so different blocks never share cached output, even if their keys are equal. The
+# optional time-to-live is specified in seconds. If `ibis.cache` is None the content is rendered
+# uncached.
+@register('cache', 'endcache')
+class CacheNode(Node):
+
+    def process_token(self, token):
+        arg = token.text[5:].strip()
+        args = utils.splitws(arg)
+        if not arg:
+            raise errors.TemplateSyntaxError("Malformed 'cache' tag.", token)
+        if len(args) > 1 and not args[-2].endswith(',') and not args[-1].startswith(','):
+            self.ttl_expr = Expression(args[-1], token)
+            arg = arg[:-len(args[-1])]
+        else:
+            self.ttl_expr = None
+        self.key_exprs = [Expression(expr, token) for expr in utils.splitc(arg, ',', strip=True)]
+
+    def exit_scope(self):
+        digest = hashlib.sha256()
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            digest.update(f"{node.token.type}\0{node.token.text}\0".encode('utf-8'))
+            stack.extend(reversed(node.children))
+        self.fragment_id = (self.token.template_id, self.token.line_number, digest.hexdigest()[:16])
+
+    def wrender(self, context):
+        cache, key, output = self.lookup(context)
+        if output is None:
+            output = ''.join(child.render(context) for child in self.children)
+            self.store(cache, key, output, context)
+        return output
+
+    def wstream(self, context):
+        cache, key, output = self.lookup(context)
+        if output is None:
+            chunks = []
+            for child in self.children:
+                for chunk in child.stream(context):
+                    chunks.append(chunk)
+                    yield chunk
+            self.store(cache, key, ''.join(chunks), context)
+        else:
+            yield output
+
+    async def wrender_async(self, context):
+        cache, output = ibis.cache, None
+        key = self.make_key([await expr.eval_async(context) for expr in self.key_exprs])
+        if cache is not None:
+            output = cache.get(key)
+        if output is None:
+            output = await render_nodes_async(self.children, context)
+            if cache is not None:
+                ttl = await self.ttl_expr.eval_async(context) if self.ttl_expr else None
+                cache.set(key, output, ttl)
+        return output
+
+    # Returns the cache, the fragment's key, and its cached output or None.
+    def lookup(self, context):
+        cache, key = ibis.cache, self.make_key([expr.eval(context) for expr in self.key_exprs])
+        if cache is None:
+            return cache, key, None
+        return cache, key, cache.get(key)
+
+    def make_key(self, values):
+        return (self.fragment_id, values[0] if len(values) == 1 else tuple(values))
+
+    def store(self, cache, key, output, context):
+        if cache is not None:
+            ttl = self.ttl_expr.eval(context) if self.ttl_expr else None
+            cache.set(key, output, ttl)
+
+
+# Node types whose references to the `loop` variable can be determined statically.
+loop_analysable_node_types = {
+    Node, TextNode, PrintNode, ForNode, EmptyNode, IfNode, ElifNode, ElseNode, CycleNode,
+    ExtendsNode, SpacelessNode, TrimNode, WithNode, CacheNode,
+}
@@ -0,0 +1,183 @@
+import collections
+import json
+import threading
+import time
+import ibis
+
+from .nodes import Node, Expression
+
+
+# The unwrapped methods. A profiler replaces these with timing wrappers while it's running and
+# restores them when it stops, so rendering has no profiling overhead when no profiler is running.
+_node_render = Node.render
+_expression_eval = Expression.eval
+
+
+# The currently running profiler, if any.
+_running = None
+
+
+# Profiles template rendering, attributing wall time to the template tags, print tags and
+# expressions which consume it. Each measurement is keyed by the template ID, the line number,
+# and a label describing the tag or expression.
+#
+#     with ibis.profiler.Profiler() as profiler:
+#         template.render(data)
+#     print(profiler.report())
+#
+# While a profiler is running, calls to Node.render() and Expression.eval() on the profiler's
+# thread are timed. For each key the profiler records the number of calls, the inclusive time
+# (including time spent in nested tags and expressions) and the exclusive time (excluding it).
+# Only one profiler can run at a time. Templates are profiled by walking their node trees, so code
+# generation is disabled while a profiler is running. Output generated by .stream() and
+# .render_async() isn't profiled.
+class Profiler:
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.inclusive = collections.Counter()
+        self.exclusive = collections.Counter()
+        self.stacks = collections.Counter()
+        self.thread = None
+        self.use_codegen = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        global _running
+        if _running is not None:
+            raise RuntimeError("A profiler is already running.")
+        _running = self
+        self.thread = threading.get_ident()
+        self.use_codegen = ibis.compiler.use_codegen
+        ibis.compiler.use_codegen = False
+        path, active = [], collections.Counter()
+        Node.render = self.wrap(_node_render, node_label, path, active)
+        Expression.eval = self.wrap(_expression_eval, expression_label, path, active)
+
+    def stop(self):
+        global _running
+        if _running is not self:
+            return
+        Node.render = _node_render
+        Expression.eval = _expression_eval
+        ibis.compiler.use_codegen = self.use_codegen
+        _running = None
+
+    # Returns a timing wrapper for an unbound render() or eval() method. The `path` list holds a
+    # [key, child_time] pair for each call in progress; `active` counts the calls in progress for
+    # each key so that recursive calls aren't counted twice in the inclusive time.
+    def wrap(self, func, label, path, active):
+        thread, perf_counter = self.thread, time.perf_counter
+
+        def wrapper(obj, context):
+            token = obj.token
+            if token is None or threading.get_ident() != thread:
+                return func(obj, context)
+            key = (token.template_id, token.line_number, label(obj))
+            path.append([key, 0.0])
+            active[key] += 1
+            start = perf_counter()
+            try:
+                return func(obj, context)
+            finally:
+                elapsed = perf_counter() - start
+                active[key] -= 1
+                exclusive = elapsed - path[-1][1]
+                self.calls[key] += 1
+                self.exclusive[key] += exclusive
+                if not active[key]:
+                    self.inclusive[key] += elapsed
+                self.stacks[tuple(entry[0] for entry in path)] += exclusive
+                path.pop()
+                if path:
+                    path[-1][1] += elapsed
+
+        return wrapper
+
+    def clear(self):
+        self.calls.clear()
+        self.inclusive.clear()
+        self.exclusive.clear()
+        self.stacks.clear()
+
+    # Returns a list of dictionaries, one for each key, sorted in descending order by `sort`, which
+    # can be 'exclusive', 'inclusive' or 'calls'. Times are in seconds.
+    def results(self, sort='exclusive'):
+        results = []
+        for key, calls in self.calls.items():
+            template_id, line_number, label = key
+            results.append({
+                'template_id': template_id,
+                'line_number': line_number,
+                'label': label,
+                'calls': calls,
+                'inclusive': self.inclusive[key],
+                'exclusive': self.exclusive[key],
+            })
+        results.sort(key=lambda result: result[sort], reverse=True)
+        return results
+
+    # Returns a plain-text table of the results. If `limit` is specified only that many rows are
+    # included.
+    def report(self, sort='exclusive', limit=None):
+        lines = [f"{'calls':>8} {'incl ms':>10} {'excl ms':>10}  location"]
+        for result in self.results(sort)[:limit]:
+            lines.append(
+                f"{result['calls']:>8} "
+                f"{result['inclusive'] * 1000:>10.3f} "
+                f"{result['exclusive'] * 1000:>10.3f}  "
+                f"{result['template_id']}:{result['line_number']} {result['label']}"
+            )
+        return "\n".join(lines)
+
+    def to_json(self, sort='exclusive', indent=2):
+        return json.dumps(self.results(sort), indent=indent)
+
+    # Returns the exclusive time of each call stack in the collapsed-stack format read by flame
+    # graph tools, i.e. one line per stack containing the semicolon-separated frames followed by a
+    # space and the time in microseconds.
+    def to_collapsed(self):
+        lines = []
+        for stack, elapsed in sorted(self.stacks.items()):
+            frames = ';'.join(frame_name(key) for key in stack)
+            lines.append(f"{frames} {round(elapsed * 1_000_000)}")
+        return "\n".join(lines)
+
+
+# Returns a label for a node, e.g. "{% for item in items %}" or "{{ item.name }}".
+def node_label(node):
+    token = node.token
+    if token.type == "INSTRUCTION":
+        return f"{{% {shorten(token.text)} %}}"
+    if token.type == "PRINT":
+        return f"{{{{ {shorten(token.text)} }}}}"
+    if token.type == "EPRINT":
+        return f"{{$ {shorten(token.text)} $}}"
+    return "text"
+
+
+# Returns a label for an expression, e.g. "expr: item.name|title".
+def expression_label(expr):
+    if expr.is_literal:
+        return f"expr: {shorten(repr(expr.literal))}"
+    label = expr.varstring + ("()" if expr.is_func_call else "")
+    label = '|'.join([label] + [name for name, func, args in expr.filters])
+    return f"expr: {shorten(label)}"
+
+
+def shorten(text, width=40):
+    text = ' '.join(text.split())
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+
+# Returns a frame name for the collapsed-stack format. Semicolons separate frames, so they're
+# replaced.
+def frame_name(key):
+    template_id, line_number, label = key
+    return f"{template_id}:{line_number} {label}".replace(';', ',')
@@ -1,38 +1,249 @@
+import io
+import os
+import itertools
+import collections
+import concurrent.futures
 import ibis
 from .context import Context
-from .nodes import ExtendsNode, BlockNode
+from .nodes import ExtendsNode, BlockNode, IncludeNode
 
 
 # A Template object is initialized with a template string containing template markup and a
 # template ID which is used to identify the template in error messages. The .render() method
 # accepts a data dictionary or a set of keyword arguments and returns a rendered output string.
+#
+# The .stream() method accepts the same arguments and returns a generator of output chunks. The
+# .render_to() method writes the output chunks directly to a text or binary file object.
+#
+# The .render_async() coroutine accepts the same arguments as .render() and awaits any awaitable
+# values in the data on demand.
+#
+# If `render_cache` is set to an ibis.caches.RenderCache instance the output of .render() is
+# cached.
 class Template:
 
+    render_cache = None
+
     def __init__(self, template_string, template_id="UNIDENTIFIED"):
-        self.root_node = ibis.compiler.compile(template_string, template_id)
+        root_node = ibis.compiler.compile(template_string, template_id)
+        self._init_from_root_node(root_node, template_id)
+
+    # Creates a Template instance from a previously compiled node tree.
+    @classmethod
+    def from_root_node(cls, root_node, template_id="UNIDENTIFIED"):
+        template = cls.__new__(cls)
+        template._init_from_root_node(root_node, template_id)
+        return template
+
+    def _init_from_root_node(self, root_node, template_id):
+        self.template_id = template_id
+        self.root_node = root_node
         self.blocks = self._register_blocks(self.root_node, {})
+        self._code = None
+        self._inheritance = None
 
     def __str__(self):
         return str(self.root_node)
 
+    # Generated code can't be pickled; it's regenerated on demand after unpickling.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_code'] = None
+        state['_inheritance'] = None
+        state.pop('render_cache', None)
+        return state
+
+    # Generated render functions for the code-generation backend. These are generated on first
+    # access and cached.
+    @property
+    def code(self):
+        if self._code is None:
+            self._code = ibis.compiler.generate(self.root_node, self.blocks, self.template_id)
+        return self._code
+
     def render(self, *pargs, **kwargs):
         data_dict = pargs[0] if pargs else kwargs
         strict_mode = kwargs.get("strict_mode", False)
+        if self.render_cache is not None:
+            return self.render_cache.render(self, data_dict, strict_mode)
         context = Context(data_dict, strict_mode)
         return self._render(context)
 
     def _render(self, context):
-        context.templates.append(self)
+        root_template = self._enter(context)
+        if ibis.compiler.use_codegen:
+            return root_template.code.render(context)
+        else:
+            return root_template.root_node.render(context)
+
+    async def render_async(self, *pargs, **kwargs):
+        data_dict = pargs[0] if pargs else kwargs
+        strict_mode = kwargs.get("strict_mode", False)
+        context = Context(data_dict, strict_mode)
+        return await self._render_async(context)
+
+    async def _render_async(self, context):
+        root_template = self._enter(context)
+        return await root_template.root_node.render_async(context)
+
+    def stream(self, *pargs, **kwargs):
+        data_dict = pargs[0] if pargs else kwargs
+        strict_mode = kwargs.get("strict_mode", False)
+        context = Context(data_dict, strict_mode)
+        yield from self._stream(context)
+
+    def _stream(self, context):
+        root_template = self._enter(context)
+        yield from root_template.root_node.stream(context)
+
+    # Renders the template with an ibis.profiler.Profiler running and returns a tuple containing
+    # the output string and the profiler. The render cache is bypassed.
+    def profile(self, *pargs, **kwargs):
+        data_dict = pargs[0] if pargs else kwargs
+        strict_mode = kwargs.get("strict_mode", False)
+        with ibis.profiler.Profiler() as profiler:
+            output = self._render(Context(data_dict, strict_mode))
+        return output, profiler
+
+    # Renders the template once for each data dictionary in an iterable, distributing the renders
+    # across a pool of `workers` processes, and returns an iterator over the rendered strings in
+    # input order. The template is sent to each worker once when the worker starts; the data is
+    # sent in chunks of `chunksize` dictionaries. The iterable is consumed lazily, with a bounded
+    # number of chunks in flight. If rendering a dictionary raises an exception the exception is
+    # returned in place of its output and the batch continues.
+    #
+    # The default number of workers is the number of CPUs. If `workers` is 0 the dictionaries are
+    # rendered in the current process. Workers use `ibis.loader` to load parent and included
+    # templates, so the loader must be configured when the workers import their modules; this is
+    # automatic on platforms which start processes by forking.
+    def render_many(self, data_iterable, workers=None, chunksize=64, strict_mode=False):
+        iterator = iter(data_iterable)
+        chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+        if workers == 0:
+            for chunk in chunks:
+                yield from _render_chunk(chunk, strict_mode, self)
+            return
+
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_render_worker, initargs=(self,)
+        )
+        max_pending = (workers or os.cpu_count() or 1) * 2
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(_render_chunk, chunk, strict_mode))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def render_to(self, fileobj, *pargs, **kwargs):
+        binary = isinstance(fileobj, (io.RawIOBase, io.BufferedIOBase))
+        binary = binary or 'b' in str(getattr(fileobj, 'mode', ''))
+        for chunk in self.stream(*pargs, **kwargs):
+            if chunk:
+                fileobj.write(chunk.encode('utf-8') if binary else chunk)
+
+    # Registers the template's inheritance chain and block table with the context. Returns the
+    # root ancestor template, i.e. the template whose node tree actually gets rendered.
+    def _enter(self, context):
+        chain, block_table = self._get_inheritance()
+        context.templates.extend(chain)
+        context.block_table = block_table
+        return chain[-1]
+
+    # Returns the template's chain of ancestors, starting with the template itself, and a table
+    # mapping each block title to the templates in the chain which define that block. The result
+    # is cached if the loader has a `generation` attribute, which the loader increments whenever
+    # it replaces a template, and recomputed when the generation changes. Otherwise the loader is
+    # called for each ancestor on every render.
+    def _get_inheritance(self):
+        loader = ibis.loader
+        generation = getattr(loader, 'generation', None)
+        if self._inheritance and generation is not None:
+            cached_loader, cached_generation, chain, block_table = self._inheritance
+            if cached_loader is loader and cached_generation == generation:
+                return chain, block_table
+
+        # The chain is only cached against a generation which didn't change while it was being
+        # computed. Another thread may reload one of the ancestors in the meantime, as may loading
+        # the ancestors themselves, in which case the chain is recomputed, up to three times.
+        for _ in range(3):
+            chain, block_table = self._compute_inheritance()
+            current_generation = getattr(loader, 'generation', None)
+            if current_generation == generation:
+                self._inheritance = (loader, generation, chain, block_table)
+                break
+            generation = current_generation
+        return chain, block_table
+
+    def _compute_inheritance(self):
+        chain = [self]
+        while parent_template := chain[-1]._load_parent():
+            if parent_template in chain:
+                msg = f"Circular inheritance: template '{chain[-1].template_id}' extends "
+                msg += f"'{parent_template.template_id}'."
+                raise ibis.errors.TemplateLoadError(msg)
+            chain.append(parent_template)
+
+        block_table = {}
+        for template in chain:
+            for title, block_node in template.blocks.items():
+                if block_node:
+                    block_table.setdefault(title, []).append(template)
+        return chain, block_table
+
+    # Returns the parent template if this template extends another template, otherwise None.
+    def _load_parent(self):
         if self.root_node.children and isinstance(self.root_node.children[0], ExtendsNode):
             if ibis.loader:
-                parent_template = ibis.loader(self.root_node.children[0].parent_name)
-                return parent_template._render(context)
+                return ibis.loader(self.root_node.children[0].parent_name)
             else:
                 msg = f"No template loader has been specified. A template loader is required "
                 msg += f"by the 'extends' tag in template '{self.template_id}'."
                 raise ibis.errors.TemplateLoadError(msg)
-        else:
-            return self.root_node.render(context)
+        return None
+
+    # Computes the state which is otherwise computed and cached on the template the first time it's
+    # rendered: its inheritance chain, its generated code if code generation is enabled, and the
+    # templates linked to its include tags. Templates which fail to load are skipped; the error is
+    # reported when the template is rendered.
+    def prepare(self):
+        try:
+            self._get_inheritance()
+        except ibis.errors.TemplateLoadError:
+            pass
+        if ibis.compiler.use_codegen:
+            self.code
+        for node in self._iter_nodes(self.root_node):
+            if isinstance(node, IncludeNode) and node.template_expr.is_literal:
+                try:
+                    node.load_template(node.template_expr.literal, Context({}, False))
+                except ibis.errors.TemplateError:
+                    pass
+
+    def _iter_nodes(self, node):
+        yield node
+        for child in node.children:
+            yield from self._iter_nodes(child)
+
+    # Returns the set of template names this template extends or includes using string literals.
+    # Includes using variable names can't be determined statically so they aren't listed.
+    def dependencies(self, node=None, names=None):
+        node = node or self.root_node
+        names = set() if names is None else names
+        if isinstance(node, ExtendsNode):
+            names.add(node.parent_name)
+        elif isinstance(node, IncludeNode) and node.template_expr.is_literal:
+            if isinstance(node.template_expr.literal, str):
+                names.add(node.template_expr.literal)
+        for child in node.children:
+            self.dependencies(child, names)
+        return names
 
     def _register_blocks(self, node, blocks):
         if isinstance(node, BlockNode):
@@ -41,3 +252,23 @@ class Template:
             self._register_blocks(child, blocks)
         return blocks
 
+
+# The template rendered by a render_many() worker process.
+_worker_template = None
+
+
+def _init_render_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+# Renders a chunk of data dictionaries, returning a list of outputs and exceptions.
+def _render_chunk(chunk, strict_mode, template=None):
+    template = template or _worker_template
+    results = []
+    for data_dict in chunk:
+        try:
+            results.append(template.render(data_dict, strict_mode=strict_mode))
+        except Exception as err:
+            results.append(err)
+    return results
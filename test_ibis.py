@@ -3,10 +3,25 @@
 # Unit tests for the Ibis package. To run the tests, execute this file.
 # ------------------------------------------------------------------------------
 
+import ast
+import asyncio
+import contextlib
 import unittest
 import datetime
+import gc
+import itertools
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
 
 import ibis
+import ibis.__main__
+import bench_ibis
 from ibis import Template
 
 
@@ -494,6 +509,53 @@ class ForTagTests(unittest.TestCase):
         rendered = Template(template_string).render(points=[(1, 2), (3, 4), (5, 6)])
         self.assertEqual(rendered, '(1,2)(3,4)(5,6)')
 
+    def test_forloop_meta_with_generator(self):
+        template_string = '{% for i in items %}{{ loop.count }}{{ loop.is_last }},{% endfor %}'
+        rendered = Template(template_string).render(items=(i for i in range(3)))
+        self.assertEqual(rendered, '1False,2False,3True,')
+
+    def test_forloop_length_with_generator(self):
+        template_string = '{% for i in items %}{{ loop.length }}{% endfor %}'
+        rendered = Template(template_string).render(items=(i for i in range(3)))
+        self.assertEqual(rendered, '333')
+
+    def test_forloop_streams_generator(self):
+        consumed = []
+        def items():
+            for i in range(3):
+                consumed.append(i)
+                yield i
+        template = Template('{% for i in items %}{{ i }}{% endfor %}')
+        chunks = template.stream(items=items())
+        self.assertEqual(next(chunks), '0')
+        self.assertEqual(consumed, [0])
+
+    def test_forloop_parent_meta(self):
+        template_string = '{% for i in "ab" %}{% for j in "cd" %}{{ loop.parent.index }}{% endfor %}{% endfor %}'
+        rendered = Template(template_string).render()
+        self.assertEqual(rendered, '0011')
+
+    def test_forloop_meta_prints_as_dict(self):
+        template = Template('{% for i in "ab" %}{% for j in "c" %}{{ loop }}{% endfor %}{% endfor %}')
+        inner = {'index': 0, 'count': 1, 'length': 1, 'is_first': True, 'is_last': True}
+        expected = ''.join(
+            str({**inner, 'parent': {'index': index, 'count': index + 1, 'length': 2,
+                'is_first': index == 0, 'is_last': index == 1, 'parent': None}})
+            for index in range(2)
+        )
+        self.assertEqual(template.render(), expected)
+
+    def test_forloop_without_loop_reference(self):
+        template = Template('{% for i in "ab" %}{{ i }}{% endfor %}')
+        self.assertFalse(template.root_node.children[0].uses_loop)
+        template = Template('{% for i in "ab" %}{% if loop.is_first %}{{ i }}{% endif %}{% endfor %}')
+        self.assertTrue(template.root_node.children[0].uses_loop)
+
+    def test_forloop_with_short_unpacked_items(self):
+        template_string = '{% for a, b in items %}{{ a }}{{ b }},{% endfor %}'
+        rendered = Template(template_string).render(items=[(1, 2), (3,)], b='x')
+        self.assertEqual(rendered, '12,3x,')
+
 
 class CycleTagTests(unittest.TestCase):
 
@@ -548,6 +610,228 @@ class TrimTagTests(unittest.TestCase):
         self.assertEqual(rendered, 'foo bar baz')
 
 
+class CacheTagTests(unittest.TestCase):
+
+    def setUp(self):
+        self.default_cache = ibis.cache
+        ibis.cache = ibis.caches.LRUCache()
+        self.counter = itertools.count()
+
+    def tearDown(self):
+        ibis.cache = self.default_cache
+
+    def cached(self, template, key):
+        return ibis.cache.get((template.root_node.children[0].fragment_id, key))
+
+    def test_cache_block_is_rendered_once(self):
+        template = Template('{% cache "nav" %}{{ counter.__next__() }}{% endcache %}')
+        self.assertEqual(template.render(counter=self.counter), '0')
+        self.assertEqual(template.render(counter=self.counter), '0')
+        self.assertEqual(ibis.cache.stats()['hits'], 1)
+
+    def test_cache_block_with_variable_key(self):
+        template = Template('{% cache "nav", user %}{{ user }}{{ counter.__next__() }}{% endcache %}')
+        self.assertEqual(template.render(user='a', counter=self.counter), 'a0')
+        self.assertEqual(template.render(user='b', counter=self.counter), 'b1')
+        self.assertEqual(template.render(user='a', counter=self.counter), 'a0')
+        self.assertEqual(self.cached(template, ('nav', 'a')), 'a0')
+
+    def test_cache_block_with_multiple_keys_and_ttl(self):
+        template = Template('{% cache "nav", user 60 %}{{ user }}{% endcache %}')
+        self.assertEqual(template.render(user='a'), 'a')
+        self.assertEqual(self.cached(template, ('nav', 'a')), 'a')
+
+    def test_cache_block_with_ttl(self):
+        template = Template('{% cache "nav" 0 %}{{ counter.__next__() }}{% endcache %}')
+        self.assertEqual(template.render(counter=self.counter), '0')
+        self.assertEqual(template.render(counter=self.counter), '1')
+        self.assertEqual(ibis.cache.stats()['expirations'], 1)
+
+    def test_cache_block_with_variable_ttl(self):
+        template = Template('{% cache key|upper ttl %}{{ key }}{% endcache %}')
+        self.assertEqual(template.render(key='nav', ttl=60), 'nav')
+        self.assertEqual(self.cached(template, 'NAV'), 'nav')
+
+    def test_cache_block_without_cache(self):
+        ibis.cache = None
+        template = Template('{% cache "nav" %}{{ counter.__next__() }}{% endcache %}')
+        self.assertEqual(template.render(counter=self.counter), '0')
+        self.assertEqual(template.render(counter=self.counter), '1')
+
+    def test_cache_block_rendering_modes(self):
+        template = Template('{% cache "nav" %}{% for i in range(3) %}{{ i }}{% endfor %}{% endcache %}')
+        self.assertEqual(''.join(template.stream()), '012')
+        self.assertEqual(self.cached(template, 'nav'), '012')
+        self.assertEqual(template.code.render(ibis.context.Context({}, False)), '012')
+        self.assertEqual(asyncio.run(template.render_async()), '012')
+        self.assertEqual(ibis.cache.stats()['hits'], 3)
+
+    def test_cache_blocks_with_equal_keys_are_distinct(self):
+        a = Template('{% cache k %}A{{ v }}{% endcache %}')
+        b = Template('{% cache k %}B{{ v }}{% endcache %}')
+        self.assertEqual(a.render(k=1, v=1), 'A1')
+        self.assertEqual(b.render(k=1, v=1), 'B1')
+        self.assertEqual(a.render(k=1, v=2), 'A1')
+
+    def test_malformed_cache_tag(self):
+        with self.assertRaises(ibis.errors.TemplateSyntaxError):
+            Template('{% cache %}{% endcache %}')
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def test_entry_limit(self):
+        cache = ibis.caches.LRUCache(max_entries=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.get('a')
+        cache.set('c', 'C')
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_byte_limit(self):
+        size = sys.getsizeof('x' * 100)
+        cache = ibis.caches.LRUCache(max_bytes=size * 2)
+        cache.set('a', 'x' * 100)
+        cache.set('b', 'y' * 100)
+        cache.set('c', 'z' * 100)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), None)
+        self.assertLessEqual(cache.stats()['bytes'], size * 2)
+
+    def test_byte_limit_without_entry_limit(self):
+        size = sys.getsizeof('x' * 100)
+        cache = ibis.caches.LRUCache(max_entries=None, max_bytes=size * 2)
+        for key in 'abc':
+            cache.set(key, key * 100)
+        self.assertEqual(len(cache), 2)
+
+    def test_oversized_value_is_not_stored(self):
+        cache = ibis.caches.LRUCache(max_bytes=10)
+        cache.set('a', 'x' * 100)
+        self.assertEqual(len(cache), 0)
+
+    def test_default_ttl(self):
+        cache = ibis.caches.LRUCache(ttl=0)
+        cache.set('a', 'A')
+        cache.set('b', 'B', ttl=60)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 'B')
+
+    def test_stats(self):
+        cache = ibis.caches.LRUCache()
+        cache.set('a', 'A')
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        cache.clear()
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_concurrent_access(self):
+        cache = ibis.caches.LRUCache(max_entries=50)
+        def worker(n):
+            for i in range(1000):
+                if cache.get(i % 100) is None:
+                    cache.set(i % 100, str(i % 100))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+        self.assertEqual(stats['entries'], 50)
+
+
+@ibis.nodes.register('greet')
+class GreetNode(ibis.nodes.Node):
+    def wrender(self, context):
+        return f"{context.get('greeting', 'hello')} {context['user']}"
+
+
+class RenderCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ibis.caches.RenderCache()
+
+    def make_template(self, template_string):
+        template = Template(template_string)
+        template.render_cache = self.cache
+        return template
+
+    def test_cached_output_is_reused(self):
+        template = self.make_template('{% for i in items %}{{ i.name }}{% endfor %}')
+        self.assertEqual(template.render(items=[{'name': 'a'}, {'name': 'b'}]), 'ab')
+        self.assertEqual(template.render(items=[{'name': 'a'}, {'name': 'b'}]), 'ab')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_changed_input_is_rerendered(self):
+        template = self.make_template('{{ a }}{% if b %}{{ c.d }}{% endif %}')
+        self.assertEqual(template.render(a=1, b=True, c={'d': 2}), '12')
+        self.assertEqual(template.render(a=1, b=True, c={'d': 3}), '13')
+        self.assertEqual(template.render(a=1, b=False, c={'d': 3}), '1')
+        self.assertEqual(template.render(a=1, b=True, c={'d': 2}), '12')
+        self.assertEqual(template.render(a=1, b=False, c={'d': 4}), '1')
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_unread_input_is_ignored(self):
+        template = self.make_template('{{ a }}')
+        template.render(a=1, b=[1])
+        self.assertEqual(template.render(a=1, b=[2]), '1')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_equal_values_of_different_types(self):
+        template = self.make_template('{{ a }}')
+        self.assertEqual(template.render(a=1), '1')
+        self.assertEqual(template.render(a=True), 'True')
+        self.assertEqual(template.render(a=1.0), '1.0')
+
+    def test_undefined_input(self):
+        template = self.make_template('{{ a.b }}')
+        self.assertEqual(template.render(), '')
+        self.assertEqual(template.render(a={'b': 1}), '1')
+        self.assertEqual(template.render(), '')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_function_calls_are_uncacheable(self):
+        template = self.make_template('{{ counter.__next__() }}')
+        counter = itertools.count()
+        self.assertEqual(template.render(counter=counter), '0')
+        self.assertEqual(template.render(counter=counter), '1')
+        self.assertEqual(self.cache.stats()['uncacheable'], 2)
+
+    def test_unhashable_input_is_uncacheable(self):
+        template = self.make_template('{{ a }}')
+        self.assertEqual(template.render(a=bytearray(b'x')), "bytearray(b'x')")
+        self.assertEqual(self.cache.stats()['uncacheable'], 1)
+
+    def test_lookups_by_custom_tags_are_recorded(self):
+        template = self.make_template('{% greet %}')
+        self.assertEqual(template.render(user='a'), 'hello a')
+        self.assertEqual(template.render(user='b'), 'hello b')
+        self.assertEqual(template.render(user='b', greeting='hi'), 'hi b')
+        self.assertEqual(template.render(user='b'), 'hello b')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_included_templates_are_cached(self):
+        template = self.make_template('{% include "one-var" %}')
+        self.assertEqual(template.render(var='foo'), 'foo')
+        self.assertEqual(template.render(var='foo'), 'foo')
+        self.assertEqual(template.render(var='bar'), 'bar')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_max_entries(self):
+        self.cache = ibis.caches.RenderCache(max_entries=2)
+        template = self.make_template('{{ a }}')
+        for a in range(5):
+            template.render(a=a)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertEqual(self.cache.stats()['evictions'], 3)
+
+
 class IncludeTagTests(unittest.TestCase):
 
     def test_include_tag_with_template_literal(self):
@@ -591,6 +875,46 @@ class IncludeTagTests(unittest.TestCase):
         self.assertEqual(rendered, 'foo--123')
 
 
+class IncludeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.default_loader = ibis.loader
+        ibis.loader = CountingDictLoader({'a': 'a{{ i }}', 'b': 'b{{ i }}'})
+        ibis.nodes.include_stats.clear()
+        ibis.nodes.collect_include_stats = True
+
+    def tearDown(self):
+        ibis.loader = self.default_loader
+        ibis.nodes.collect_include_stats = False
+
+    def test_literal_include_is_linked(self):
+        template = Template('{% for i in range(100) %}{% include "a" %}{% endfor %}')
+        self.assertEqual(template.render(), ''.join(f'a{i}' for i in range(100)))
+        self.assertEqual(template.render(), ''.join(f'a{i}' for i in range(100)))
+        self.assertEqual(ibis.loader.calls, 1)
+        self.assertEqual(ibis.nodes.include_stats['loader_calls'], 1)
+        self.assertEqual(ibis.nodes.include_stats['linked_hits'], 199)
+
+    def test_dynamic_include_is_cached_per_render(self):
+        template = Template('{% for i in range(100) %}{% include names.cycle() %}{% endfor %}')
+        names = {'cycle': itertools.cycle(['a', 'b']).__next__}
+        template.render(names=names)
+        self.assertEqual(ibis.loader.calls, 2)
+        self.assertEqual(ibis.nodes.include_stats['cache_hits'], 98)
+
+    def test_linked_include_is_relinked_when_loader_changes(self):
+        template = Template('{% include "a" %}')
+        self.assertEqual(template.render(i=1), 'a1')
+        ibis.loader.templates['a'] = Template('changed')
+        ibis.loader.generation += 1
+        self.assertEqual(template.render(), 'changed')
+
+    def test_stats_are_only_collected_when_enabled(self):
+        ibis.nodes.collect_include_stats = False
+        Template('{% include "a" %}{% include "a" %}').render()
+        self.assertEqual(ibis.nodes.include_stats, {})
+
+
 class TemplateInheritanceTests(unittest.TestCase):
 
     def test_single_level_inheritance(self):
@@ -679,6 +1003,59 @@ class TemplateInheritanceTests(unittest.TestCase):
         self.assertEqual(rendered, '|#|outer-foo|inner-foo|override-foo|outer-foo|#|')
 
 
+class CountingDictLoader(ibis.loaders.DictLoader):
+
+    def __init__(self, template_strings):
+        super().__init__(template_strings)
+        self.calls = 0
+
+    def __call__(self, name):
+        self.calls += 1
+        return super().__call__(name)
+
+
+class InheritanceCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.default_loader = ibis.loader
+        ibis.loader = CountingDictLoader({
+            'base': '{% block a %}base-a{% endblock %}|{% block b %}base-b{% endblock %}',
+            'middle': '{% extends "base" %}{% block a %}middle-a|{{ super() }}{% endblock %}',
+            'leaf': '{% extends "middle" %}{% block a %}leaf-a|{{ super() }}{% endblock %}',
+            'circular': '{% extends "circular" %}',
+            'other': 'other',
+        })
+
+    def tearDown(self):
+        ibis.loader = self.default_loader
+
+    def test_chain_is_cached(self):
+        template = ibis.loader('leaf')
+        self.assertEqual(template.render(), 'leaf-a|middle-a|base-a|base-b')
+        calls = ibis.loader.calls
+        self.assertEqual(template.render(), 'leaf-a|middle-a|base-a|base-b')
+        self.assertEqual(ibis.loader.calls, calls)
+
+    def test_chain_is_recomputed_when_loader_changes(self):
+        template = ibis.loader('leaf')
+        template.render()
+        ibis.loader.templates['middle'] = Template('{% extends "base" %}', 'middle')
+        ibis.loader.generation += 1
+        self.assertEqual(template.render(), 'leaf-a|base-a|base-b')
+
+    def test_chain_is_kept_when_another_template_is_compiled(self):
+        template = ibis.loader('leaf')
+        template.render()
+        ibis.loader('other')
+        calls = ibis.loader.calls
+        self.assertEqual(template.render(), 'leaf-a|middle-a|base-a|base-b')
+        self.assertEqual(ibis.loader.calls, calls)
+
+    def test_circular_inheritance(self):
+        with self.assertRaises(ibis.errors.TemplateLoadError):
+            ibis.loader('circular').render()
+
+
 class StrictModeTests(unittest.TestCase):
 
     def test_defined_variable(self):
@@ -751,6 +1128,100 @@ class UnexpectedErrorTests(unittest.TestCase):
             rendered = Template(template_string).render()
 
 
+class StreamTests(unittest.TestCase):
+
+    def test_identical_output(self):
+        for template_string, data in CodegenTests.templates:
+            template = Template(template_string)
+            data = {**CodegenTests.data, **data}
+            self.assertEqual(''.join(template.stream(data)), template.render(data))
+
+    def test_inheritance(self):
+        template = ibis.loader('child')
+        self.assertEqual(''.join(template.stream(var='foo')), template.render(var='foo'))
+
+    def test_loop_yields_incrementally(self):
+        template = Template('{% for i in items %}{{ i }}{% endfor %}')
+        chunks = template.stream(items=(i for i in range(3)))
+        self.assertEqual(list(chunks), ['0', '1', '2'])
+
+    def test_rendering_error(self):
+        template = Template('{% for i in [1] %}{% evil_renderer %}{% endfor %}')
+        with self.assertRaises(ibis.errors.TemplateRenderingError):
+            list(template.stream())
+
+    def test_render_to_text_stream(self):
+        fileobj = io.StringIO()
+        Template('{% for i in [1, 2] %}{{ i }}{% endfor %}').render_to(fileobj)
+        self.assertEqual(fileobj.getvalue(), '12')
+
+    def test_render_to_binary_stream(self):
+        fileobj = io.BytesIO()
+        Template('{{ var }}').render_to(fileobj, var='\u00e9')
+        self.assertEqual(fileobj.getvalue(), '\u00e9'.encode('utf-8'))
+
+
+class AsyncRenderTests(unittest.TestCase):
+
+    def render(self, template, *pargs, **kwargs):
+        return asyncio.run(template.render_async(*pargs, **kwargs))
+
+    def test_identical_output(self):
+        for template_string, data in CodegenTests.templates:
+            template = Template(template_string)
+            data = {**CodegenTests.data, **data}
+            self.assertEqual(self.render(template, data), template.render(data))
+
+    def test_awaitable_values(self):
+        async def get_user():
+            return {'name': 'foo'}
+        template = Template('{{ user.name }}|{{ user.name|upper }}')
+        self.assertEqual(self.render(template, user=get_user()), 'foo|FOO')
+
+    def test_errors_in_awaitable_values_are_raised(self):
+        async def bad():
+            raise KeyError('x')
+        with self.assertRaises(ibis.errors.TemplateRenderingError):
+            self.render(Template('[{{ x }}]'), x=bad())
+
+    def test_awaitable_function_result(self):
+        async def get_name(arg):
+            return arg
+        template = Template('{{ get_name("foo") }}')
+        self.assertEqual(self.render(template, get_name=get_name), 'foo')
+
+    def test_async_iterable(self):
+        async def numbers():
+            for i in range(3):
+                yield i
+        template = Template('{% for i in numbers %}{{ i }}{{ loop.length }}{% endfor %}')
+        self.assertEqual(self.render(template, numbers=numbers()), '031323')
+
+    def test_inheritance_with_super(self):
+        async def get_var():
+            return 'foo'
+        template = ibis.loader('child')
+        self.assertEqual(self.render(template, var=get_var()), template.render(var='foo'))
+
+    def test_concurrent_includes(self):
+        async def render():
+            event = asyncio.Event()
+            async def first():
+                await event.wait()
+                return 'foo'
+            async def second():
+                event.set()
+                return 'bar'
+            template = Template('{% include "one-var" with var = a %}|{% include "one-var" with var = b %}')
+            return await asyncio.wait_for(template.render_async(a=first(), b=second()), 1)
+        self.assertEqual(asyncio.run(render()), 'foo|bar')
+
+    def test_strict_mode(self):
+        template = Template('{{ var }}')
+        with self.assertRaises(ibis.errors.UndefinedVariable):
+            self.render(template, strict_mode=True)
+
+
 class TestObject:
 
     def __init__(self):
@@ -875,6 +1346,72 @@ class VariableLookupTests(unittest.TestCase):
         self.assertEqual(rendered, 'f--o--o')
 
 
+class AttrDict(dict):
+    pass
+
+
+class AccessorTests(unittest.TestCase):
+
+    def test_mixed_types_at_one_site(self):
+        obj, attrdict = TestObject(), AttrDict(str_attr='key')
+        attrdict.str_attr = 'attr'
+        items = [{'str_attr': 'dict'}, obj, ['list'], {'str_attr': 'dict'}, attrdict, obj]
+        template = Template('{% for item in items %}{{ item.str_attr }},{% endfor %}')
+        self.assertEqual(template.render(items=items * 2), 'dict,foo,,dict,attr,foo,' * 2)
+
+    def test_index_access_is_cached(self):
+        template = Template('{% for item in items %}{{ item.1 }}{% endfor %}')
+        self.assertEqual(template.render(items=[[0, 1], (2, 3), {'1': 4}, [5]]), '134')
+        accessor = template.root_node.children[0].for_branch.children[0].exprs[0].accessor
+        self.assertEqual(accessor.caches[1][list], ibis.context.INDEX)
+        self.assertEqual(accessor.caches[1][dict], ibis.context.KEY)
+
+    def test_instance_attributes_are_not_assumed(self):
+        first, second = TestObject(), TestObject()
+        del second.str_attr
+        template = Template('{{ obj.str_attr }}')
+        self.assertEqual(template.render(obj=first), 'foo')
+        self.assertEqual(template.render(obj=second), '')
+        with self.assertRaises(ibis.errors.UndefinedVariable):
+            template.render(obj=second, strict_mode=True)
+
+    def test_unset_slots_are_not_assumed(self):
+        first, second = SlotsObject(), SlotsObject()
+        first.x = 'X'
+        template = Template('{% for o in xs %}{{ o.x }}|{% endfor %}')
+        self.assertEqual(template.render(xs=[first, second, first, second]), 'X|item-x|X|item-x|')
+
+    def test_properties_are_not_assumed(self):
+        first, second = PropertyObject(True), PropertyObject(False)
+        template = Template('{% for o in xs %}{{ o.x }}|{% endfor %}')
+        self.assertEqual(template.render(xs=[first, second, first, second]), 'X|item-x|X|item-x|')
+
+
+class SlotsObject:
+
+    __slots__ = ('x',)
+
+    def __getitem__(self, key):
+        return f'item-{key}'
+
+
+class PropertyObject:
+
+    __slots__ = ('has_x',)
+
+    def __init__(self, has_x):
+        self.has_x = has_x
+
+    @property
+    def x(self):
+        if self.has_x:
+            return 'X'
+        raise AttributeError('x')
+
+    def __getitem__(self, key):
+        return f'item-{key}'
+
+
 class ContextShadowingTests(unittest.TestCase):
 
     def test_variable_name_template(self):
@@ -893,6 +1430,38 @@ class ContextShadowingTests(unittest.TestCase):
         self.assertEqual(rendered, 'foo')
 
 
+class ContextScopeTests(unittest.TestCase):
+
+    def test_push_and_pop_restore_shadowed_values(self):
+        context = ibis.context.Context({'foo': 'data'}, False)
+        context.push()
+        context['foo'] = 'outer'
+        context.push()
+        context['foo'] = 'inner'
+        context['bar'] = 'inner'
+        self.assertEqual(context['foo'], 'inner')
+        context.pop()
+        self.assertEqual(context['foo'], 'outer')
+        self.assertIsNone(context.get('bar'))
+        context.pop()
+        self.assertEqual(context['foo'], 'data')
+
+    def test_variable_names_matching_scope_attributes(self):
+        template_string = '{{ scope }}{{ get }}{{ layers }}{{ push }}'
+        rendered = Template(template_string).render(scope='a', get='b', layers='c', push='d')
+        self.assertEqual(rendered, 'abcd')
+
+    def test_lookup_through_many_scopes(self):
+        context = ibis.context.Context({'foo': 'bar'}, False)
+        for index in range(20):
+            context.push()
+            context[f'var{index}'] = index
+        self.assertEqual(context['foo'], 'bar')
+        self.assertEqual(context['var0'], 0)
+        self.assertEqual(context['var19'], 19)
+        self.assertIsNone(context.get('var20'))
+
+
 class ParsingErrorTests(unittest.TestCase):
 
     def test_unrecognised_tag(self):
@@ -938,6 +1507,36 @@ class LexingErrorTests(unittest.TestCase):
         with self.assertRaises(ibis.errors.TemplateLexingError):
             template = Template(template_string)
 
+    def test_unclosed_tag_line_number(self):
+        template_string = 'foo\n{{ bar }}\n{% baz \n'
+        with self.assertRaises(ibis.errors.TemplateLexingError) as cm:
+            template = Template(template_string)
+        self.assertEqual(cm.exception.line_number, 3)
+
+
+class LexerTests(unittest.TestCase):
+
+    def test_token_stream(self):
+        template_string = 'a\n{# b\n #}{{ c }}\n{$ d $}{% e\n %}\nf'
+        tokens = ibis.compiler.Lexer(template_string, 'id').tokenize()
+        self.assertEqual(
+            [(t.type, t.text, t.line_number) for t in tokens],
+            [
+                ("TEXT", "a\n", 1),
+                ("PRINT", "c", 3),
+                ("TEXT", "\n", 3),
+                ("EPRINT", "d", 4),
+                ("INSTRUCTION", "e", 4),
+                ("TEXT", "\nf", 5),
+            ]
+        )
+
+    def test_unmatched_delimiter_characters(self):
+        template_string = '{ } # % $ }} %} #} $}'
+        tokens = ibis.compiler.Lexer(template_string, 'id').tokenize()
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(tokens[0].text, template_string)
+
 
 @ibis.filters.register('evil_filter')
 def evil_filter(arg):
@@ -1022,6 +1621,71 @@ class FileLoaderTests(unittest.TestCase):
             loader("file-does-not-exist")
 
 
+class FileLoaderIndexTests(unittest.TestCase):
+
+    def test_indexed_lookup(self):
+        loader = ibis.loaders.FileLoader("tests/base1", "tests/base2", index=True)
+        self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+        self.assertEqual(loader("template-ghi.ibis").render().strip(), "ghi")
+        self.assertEqual(loader.index["template-ghi.ibis"], os.path.join("tests/base2", "template-ghi.ibis"))
+        with self.assertRaises(ibis.errors.TemplateLoadError):
+            loader("file-does-not-exist")
+
+    def test_index_priority_and_subdirectories(self):
+        with tempfile.TemporaryDirectory() as dir1, tempfile.TemporaryDirectory() as dir2:
+            os.makedirs(os.path.join(dir2, "sub"))
+            for base_dir, filename, content in [
+                (dir1, "a.txt", "first"), (dir2, "a.txt", "second"), (dir2, "sub/b.txt", "b"),
+            ]:
+                with open(os.path.join(base_dir, filename), 'w') as file:
+                    file.write(content)
+            loader = ibis.loaders.FileLoader(dir1, dir2, index=True)
+            self.assertEqual(loader("a.txt").render(), "first")
+            self.assertEqual(loader("sub/b.txt").render(), "b")
+            self.assertEqual(loader("sub/../sub/b.txt").render(), "b")
+
+    def create_after_miss(self, loader, base_dir):
+        with self.assertRaises(ibis.errors.TemplateLoadError):
+            loader("new.txt")
+        with open(os.path.join(base_dir, "new.txt"), 'w') as file:
+            file.write("new")
+
+    def test_missing_templates_are_not_remembered_by_default(self):
+        with tempfile.TemporaryDirectory() as base_dir:
+            loader = ibis.loaders.FileLoader(base_dir)
+            self.create_after_miss(loader, base_dir)
+            self.assertNotIn("new.txt", loader.missing)
+            self.assertEqual(loader("new.txt").render(), "new")
+
+    def test_missing_templates_are_remembered(self):
+        with tempfile.TemporaryDirectory() as base_dir:
+            for kwargs in ({'index': True}, {'miss_ttl': 60}):
+                loader = ibis.loaders.FileLoader(base_dir, **kwargs)
+                self.create_after_miss(loader, base_dir)
+                self.assertIn("new.txt", loader.missing)
+                with self.assertRaises(ibis.errors.TemplateLoadError):
+                    loader("new.txt")
+                loader.reindex()
+                self.assertEqual(loader("new.txt").render(), "new")
+                os.remove(os.path.join(base_dir, "new.txt"))
+
+    def test_missing_templates_expire(self):
+        with tempfile.TemporaryDirectory() as base_dir:
+            loader = ibis.loaders.FileLoader(base_dir, miss_ttl=60)
+            self.create_after_miss(loader, base_dir)
+            loader.missing["new.txt"] = time.monotonic() - 1
+            self.assertEqual(loader("new.txt").render(), "new")
+            self.assertNotIn("new.txt", loader.missing)
+
+    def test_missing_templates_are_bounded(self):
+        loader = ibis.loaders.FileLoader("tests/base1", miss_ttl=60)
+        loader.max_misses = 10
+        for i in range(20):
+            with self.assertRaises(ibis.errors.TemplateLoadError):
+                loader(f"missing-{i}")
+        self.assertEqual(list(loader.missing), [f"missing-{i}" for i in range(10, 20)])
+
+
 class FileReloaderTests(unittest.TestCase):
 
     def test_single_base(self):
@@ -1053,5 +1717,899 @@ class FileReloaderTests(unittest.TestCase):
             loader("file-does-not-exist")
 
 
+class ReloadModeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base_dir = self.tempdir.name
+        self.write("template.ibis", "old", 1000)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, filename, content, mtime):
+        path = os.path.join(self.base_dir, filename)
+        with open(path, 'w') as file:
+            file.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_unthrottled_reloading(self):
+        loader = ibis.loaders.FileReloader(self.base_dir)
+        self.assertEqual(loader("template.ibis").render(), "old")
+        self.write("template.ibis", "new", 2000)
+        self.assertEqual(loader("template.ibis").render(), "new")
+
+    def test_throttled_reloading(self):
+        loader = ibis.loaders.FileReloader(self.base_dir, check_interval=0.2)
+        self.assertEqual(loader("template.ibis").render(), "old")
+        self.write("template.ibis", "new", 2000)
+        self.assertEqual(loader("template.ibis").render(), "old")
+        time.sleep(0.25)
+        self.assertEqual(loader("template.ibis").render(), "new")
+        self.assertEqual(loader.stats()['compiles'], 2)
+
+    def test_polling_reloader(self):
+        loader = ibis.loaders.FileReloader(self.base_dir, poll_interval=0.01)
+        try:
+            self.assertEqual(loader("template.ibis").render(), "old")
+            self.write("template.ibis", "new", 2000)
+            deadline = time.monotonic() + 5
+            while loader("template.ibis").render() == "old" and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(loader("template.ibis").render(), "new")
+            self.assertEqual(loader.stats()['misses'], 1)
+            self.assertEqual(loader.stats()['compiles'], 2)
+        finally:
+            loader.close()
+        self.assertIsNone(loader.poller)
+
+    def test_scan(self):
+        loader = ibis.loaders.FileReloader(self.base_dir)
+        self.write("other.ibis", "other", 1000)
+        loader("template.ibis")
+        loader("other.ibis")
+        self.write("template.ibis", "{% if %}", 2000)
+        os.remove(os.path.join(self.base_dir, "other.ibis"))
+        loader.scan()
+        self.assertEqual(len(loader.cache), 0)
+        with self.assertRaises(ibis.errors.TemplateSyntaxError):
+            loader("template.ibis")
+        with self.assertRaises(ibis.errors.TemplateLoadError):
+            loader("other.ibis")
+
+
+class DependencyTrackingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.default_loader = ibis.loader
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base_dir = self.tempdir.name
+        self.write("base.ibis", "[{% block content %}{% endblock %}]", 1000)
+        self.write("page.ibis", '{% extends "base.ibis" %}{% block content %}'
+            '{% include "partial.ibis" %}{% endblock %}', 1000)
+        self.write("partial.ibis", "partial", 1000)
+        self.write("other.ibis", "other", 1000)
+        ibis.loader = ibis.loaders.FileReloader(self.base_dir)
+
+    def tearDown(self):
+        ibis.loader = self.default_loader
+        self.tempdir.cleanup()
+
+    def write(self, filename, content, mtime):
+        path = os.path.join(self.base_dir, filename)
+        with open(path, 'w') as file:
+            file.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_template_dependencies(self):
+        template = Template('{% extends "a" %}{% block b %}{% include "c" %}{% include d %}{% endblock %}')
+        self.assertEqual(template.dependencies(), {"a", "c"})
+
+    def test_dependency_graph(self):
+        ibis.loader("page.ibis").render()
+        self.assertEqual(sorted(ibis.loader.dependency_closure("page.ibis")), ["base.ibis", "partial.ibis"])
+        self.assertEqual(ibis.loader.dependency_closure("base.ibis"), [])
+
+    def test_modified_parent_is_reloaded(self):
+        ibis.loader("other.ibis")
+        self.assertEqual(ibis.loader("page.ibis").render(), "[partial]")
+        self.write("base.ibis", "<{% block content %}{% endblock %}>", 2000)
+        self.assertEqual(ibis.loader("page.ibis").render(), "<partial>")
+        self.assertEqual(ibis.loader.stats()['compiles'], 5)
+
+    def test_modified_include_is_reloaded(self):
+        self.assertEqual(ibis.loader("page.ibis").render(), "[partial]")
+        self.write("partial.ibis", "changed", 2000)
+        self.assertEqual(ibis.loader("page.ibis").render(), "[changed]")
+        self.assertEqual(ibis.loader.stats()['compiles'], 4)
+
+    def test_render_does_not_reload_dependencies(self):
+        template = ibis.loader("page.ibis")
+        template.render()
+        template.render()
+        stats = ibis.loader.stats()
+        template.render()
+        template.render()
+        self.assertEqual(ibis.loader.stats(), stats)
+
+    def test_modified_evicted_include_is_reloaded(self):
+        ibis.loader = ibis.loaders.FileReloader(self.base_dir, max_entries=2)
+        self.assertEqual(ibis.loader("page.ibis").render(), "[partial]")
+        ibis.loader("page.ibis")
+        ibis.loader("other.ibis")
+        self.assertEqual(ibis.loader.cache.keys(), ["page.ibis", "other.ibis"])
+        generation = ibis.loader.generation
+        self.assertEqual(ibis.loader("page.ibis").render(), "[partial]")
+        self.assertEqual(ibis.loader.generation, generation)
+        self.write("partial.ibis", "changed", 2000)
+        self.assertEqual(ibis.loader("page.ibis").render(), "[changed]")
+
+    def test_deleted_dependency(self):
+        self.assertEqual(ibis.loader("page.ibis").render(), "[partial]")
+        os.remove(os.path.join(self.base_dir, "partial.ibis"))
+        with self.assertRaises(ibis.errors.TemplateLoadError):
+            ibis.loader("page.ibis").render()
+
+
+class LoaderCacheTests(unittest.TestCase):
+
+    def test_dict_loader_max_entries(self):
+        loader = ibis.loaders.DictLoader({'a': 'a', 'b': 'b', 'c': 'c'}, max_entries=2)
+        loader('a')
+        loader('b')
+        loader('a')
+        loader('c')
+        self.assertEqual(list(loader.templates.keys()), ['a', 'c'])
+        loader('b')
+        stats = loader.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 4))
+        self.assertEqual((stats['compiles'], stats['evictions']), (4, 2))
+        self.assertGreater(stats['compile_time'], 0)
+
+    def test_dict_loader_max_bytes(self):
+        template_strings = {str(i): '{{ foo }}' * 50 for i in range(10)}
+        size = ibis.loaders.template_size(Template(template_strings['0']))
+        loader = ibis.loaders.DictLoader(template_strings, max_bytes=size * 3)
+        for name in template_strings:
+            self.assertEqual(loader(name).render(foo='x'), 'x' * 50)
+        self.assertEqual(len(loader.templates), 3)
+        self.assertLessEqual(loader.stats()['bytes'], size * 3)
+        self.assertEqual(loader.stats()['evictions'], 7)
+
+    def test_file_loader_stats(self):
+        loader = ibis.loaders.FileLoader("tests/base1", "tests/base2", max_entries=1)
+        loader("template-abc.ibis")
+        loader("template-abc.ibis")
+        loader("template-ghi.ibis")
+        self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+        stats = loader.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['compiles']), (1, 3, 3))
+        self.assertEqual((stats['evictions'], stats['entries']), (2, 1))
+
+    def test_file_reloader_stats(self):
+        loader = ibis.loaders.FileReloader("tests/base1", max_entries=1)
+        loader("template-abc.ibis")
+        loader("template-abc.ibis")
+        loader("template-def.ibis")
+        self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+        stats = loader.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 2))
+
+    def test_inheritance_after_eviction(self):
+        default_loader = ibis.loader
+        ibis.loader = ibis.loaders.DictLoader({
+            'base': '[{% block a %}{% endblock %}]',
+            'child': '{% extends "base" %}{% block a %}{{ x }}{% endblock %}',
+            'other': 'other',
+        }, max_entries=1)
+        try:
+            child = ibis.loader('child')
+            self.assertEqual(child.render(x=1), '[1]')
+            ibis.loader('other')
+            self.assertEqual(child.render(x=2), '[2]')
+        finally:
+            ibis.loader = default_loader
+
+    def test_generation_advances_only_when_source_changes(self):
+        loader = ibis.loaders.DictLoader({str(i): str(i) for i in range(5)}, max_entries=2)
+        for _ in range(2):
+            for i in range(5):
+                loader(str(i))
+        self.assertEqual(loader.stats()['evictions'], 8)
+        self.assertEqual(loader.generation, 0)
+        loader.template_strings['0'] = 'changed'
+        self.assertEqual(loader('0').render(), 'changed')
+        self.assertEqual(loader.generation, 1)
+
+
+class PrecompileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base_dir = self.tempdir.name
+        os.makedirs(os.path.join(self.base_dir, "sub"))
+        self.write("good.txt", "{{ foo }}")
+        self.write("sub/good.txt", "{% if foo %}{{ foo }}{% endif %}")
+        self.write("bad1.txt", "{% if foo %}")
+        self.write("sub/bad2.txt", "{{ foo|nosuchfilter }}")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, filename, content):
+        with open(os.path.join(self.base_dir, filename), 'w') as file:
+            file.write(content)
+
+    def test_precompile_in_process(self):
+        loader = ibis.loaders.FileLoader(self.base_dir)
+        names = loader.precompile("*good.txt", workers=0)
+        self.assertEqual(sorted(names), ["good.txt", "sub/good.txt"])
+        self.assertEqual(loader.stats()['compiles'], 0)
+        self.assertEqual(loader("sub/good.txt").render(foo="x"), "x")
+        self.assertEqual(loader.stats()['hits'], 1)
+
+    def test_precompile_reports_all_errors(self):
+        for loader_class in (ibis.loaders.FileLoader, ibis.loaders.FileReloader):
+            loader = loader_class(self.base_dir)
+            with self.assertRaises(ibis.errors.PrecompileError) as context:
+                loader.precompile(workers=2)
+            errors = context.exception.errors
+            self.assertEqual(sorted(errors), ["bad1.txt", "sub/bad2.txt"])
+            self.assertIsInstance(errors["bad1.txt"], ibis.errors.TemplateSyntaxError)
+            self.assertIn("nosuchfilter", str(context.exception))
+            self.assertEqual(sorted(loader.cache.keys()), ["good.txt", "sub/good.txt"])
+
+    def test_precompile_custom_delimiters(self):
+        default = ibis.compiler.print_start, ibis.compiler.print_end
+        ibis.compiler.print_start, ibis.compiler.print_end = '[[', ']]'
+        try:
+            self.write("custom.txt", "[[ foo ]]")
+            loader = ibis.loaders.FileLoader(self.base_dir)
+            loader.precompile("custom.txt", workers=2)
+            self.assertEqual(loader("custom.txt").render(foo="x"), "x")
+        finally:
+            ibis.compiler.print_start, ibis.compiler.print_end = default
+
+    def test_precompile_populates_disk_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            loader = ibis.loaders.FileLoader(self.base_dir, cache_dir=cache_dir)
+            loader.precompile("*good.txt", workers=2)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            loader = ibis.loaders.FileReloader(self.base_dir, cache_dir=cache_dir)
+            loader.precompile("*good.txt", workers=0)
+            self.assertEqual(loader.stats()['compiles'], 0)
+            self.assertEqual(loader("good.txt").render(foo="y"), "y")
+
+    def test_command_line(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            self.assertEqual(ibis.__main__.main(["precompile", "tests/base1", "tests/base2"]), 0)
+            self.assertEqual(ibis.__main__.main(["precompile", self.base_dir, "--workers", "0"]), 1)
+        self.assertIn("Compiled 4 template(s).", output.getvalue())
+        self.assertIn("bad1.txt", output.getvalue())
+        self.assertIn("Compiled 2 template(s), 2 failed.", output.getvalue())
+
+
+class RenderManyTests(unittest.TestCase):
+
+    def test_outputs_are_in_input_order(self):
+        template = Template('{% extends "base" %}{% block content %}{{ i }}{% endblock %}')
+        data = ({'i': i} for i in range(50))
+        outputs = list(template.render_many(data, workers=2, chunksize=3))
+        self.assertEqual(outputs, [f'|#|{i}|#|' for i in range(50)])
+
+    def test_errors_are_returned_in_place(self):
+        template = Template('{{ i }}{{ j }}')
+        data = [{'i': 0, 'j': 0}, {'i': 1}, {'i': 2, 'j': 2}]
+        for workers in (0, 2):
+            outputs = list(template.render_many(data, workers=workers, chunksize=2, strict_mode=True))
+            self.assertEqual(outputs[0], '00')
+            self.assertIsInstance(outputs[1], ibis.errors.UndefinedVariable)
+            self.assertEqual(outputs[2], '22')
+
+    def test_input_is_consumed_lazily(self):
+        template = Template('{{ i }}')
+        outputs = template.render_many(({'i': i} for i in itertools.count()), workers=2, chunksize=4)
+        self.assertEqual(list(itertools.islice(outputs, 10)), [str(i) for i in range(10)])
+        outputs.close()
+
+
+class WarmupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.default_loader = ibis.loader
+        self.default_codegen = ibis.compiler.use_codegen
+
+    def tearDown(self):
+        ibis.loader = self.default_loader
+        ibis.compiler.use_codegen = self.default_codegen
+
+    def test_warmup_prepares_templates(self):
+        ibis.loader = CountingDictLoader({
+            'base': '[{% block a %}{% endblock %}]',
+            'page': '{% extends "base" %}{% block a %}{% include "partial" %}{% endblock %}',
+            'partial': '{{ x }}',
+        })
+        ibis.compiler.use_codegen = True
+        names = ibis.loaders.warmup(freeze=False)
+        self.assertEqual(sorted(names), ['base', 'page', 'partial'])
+        page = ibis.loader('page')
+        self.assertIsNotNone(page._code)
+        calls = ibis.loader.calls
+        self.assertEqual(page.render(x=1), '[1]')
+        self.assertEqual(ibis.loader.calls, calls)
+
+    def test_warmup_with_custom_loader(self):
+        templates = {'a': Template('a'), 'b': Template('{% include "a" %}')}
+        ibis.loader = templates.__getitem__
+        ibis.compiler.use_codegen = True
+        with self.assertRaises(TypeError):
+            ibis.loaders.warmup(freeze=False)
+        self.assertEqual(ibis.loaders.warmup(freeze=False, names=['b']), ['b'])
+        self.assertIsNotNone(templates['b']._code)
+
+    def read_memory_stats(self):
+        stats = {}
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                key, value = line.split()[:2]
+                if key in ('Shared_Clean:', 'Shared_Dirty:', 'Private_Clean:', 'Private_Dirty:'):
+                    stats[key.rstrip(':')] = int(value) * 1024
+        return stats
+
+    # Forks a worker after warming up and freezing the templates. The worker runs a full garbage
+    # collection, which would write to, and so unshare, every page holding a template without
+    # gc.freeze(). It then renders every template, which updates the reference counts of the
+    # templates' objects and so does copy their pages, but shouldn't copy much more than that
+    # or compile anything.
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps_rollup') and hasattr(os, 'fork'),
+        "requires /proc/self/smaps_rollup and os.fork()")
+    def test_forked_worker_shares_templates(self):
+        template_string = '{% for x in items %}<li>{{ x.name|upper }}{% if x.flag %}y{% endif %}</li>{% endfor %}'
+        names = [f't{i}' for i in range(100)]
+        ibis.loader = ibis.loaders.DictLoader({name: template_string * 20 for name in names})
+        try:
+            ibis.loaders.warmup()
+            template_bytes = sum(ibis.loaders.template_size(ibis.loader(name)) for name in names)
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    before = self.read_memory_stats()
+                    gc.collect()
+                    collected = self.read_memory_stats()
+                    for name in names:
+                        ibis.loader(name).render(items=[{'name': 'a', 'flag': True}])
+                    gc.collect()
+                    rendered = self.read_memory_stats()
+                    compiles = ibis.loader.stats()['compiles']
+                    os.write(write_fd, repr((before, collected, rendered, compiles)).encode())
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as file:
+                before, collected, rendered, compiles = ast.literal_eval(file.read())
+            os.waitpid(pid, 0)
+        finally:
+            gc.unfreeze()
+        self.assertLess(collected['Private_Dirty'] - before['Private_Dirty'], template_bytes * 0.25)
+        self.assertLess(rendered['Private_Dirty'] - before['Private_Dirty'], template_bytes * 1.5)
+        self.assertEqual(compiles, len(names))
+
+
+class BuildTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.template_dir = os.path.join(self.tempdir.name, "templates")
+        self.data_dir = os.path.join(self.tempdir.name, "data")
+        self.output_dir = os.path.join(self.tempdir.name, "output")
+        self.write(self.template_dir, "layout.html", "<{% block main %}{% endblock %}>")
+        self.write(self.template_dir, "page.html",
+            '{% extends "layout.html" %}{% block main %}{% include "title.html" %}{% endblock %}')
+        self.write(self.template_dir, "title.html", "{{ title }}")
+        self.write(self.template_dir, "other.html", "other {{ title }}")
+        self.write(self.data_dir, "index.html.json", '{"template": "page.html", "title": "Home"}')
+        self.write(self.data_dir, "blog/post.html.json", '{"template": "page.html", "title": "Post"}')
+        self.write(self.data_dir, "other.html.json", '{"title": "Other"}')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, base_dir, filename, content):
+        path = os.path.join(base_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+
+    def read(self, filename):
+        with open(os.path.join(self.output_dir, filename)) as file:
+            return file.read()
+
+    def build(self, **kwargs):
+        return ibis.build.build([self.template_dir], self.data_dir, self.output_dir, **kwargs)
+
+    def test_build(self):
+        result = self.build(workers=2)
+        self.assertEqual(sorted(result.built), ["blog/post.html", "index.html", "other.html"])
+        self.assertEqual(self.read("index.html"), "<Home>")
+        self.assertEqual(self.read("blog/post.html"), "<Post>")
+        self.assertEqual(self.read("other.html"), "other Other")
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+            [".ibis-manifest.json", "blog", "index.html", "other.html"])
+
+    def test_unchanged_pages_are_skipped(self):
+        self.build(workers=0)
+        result = self.build(workers=0)
+        self.assertEqual((result.built, len(result.skipped)), ([], 3))
+
+        self.write(self.data_dir, "index.html.json", '{"template": "page.html", "title": "New"}')
+        result = self.build(workers=0)
+        self.assertEqual(result.built, ["index.html"])
+        self.assertEqual(self.read("index.html"), "<New>")
+
+        self.write(self.template_dir, "title.html", "[{{ title }}]")
+        result = self.build(workers=0)
+        self.assertEqual(sorted(result.built), ["blog/post.html", "index.html"])
+        self.assertEqual(self.read("blog/post.html"), "<[Post]>")
+
+        os.remove(os.path.join(self.output_dir, "other.html"))
+        self.assertEqual(self.build(workers=0).built, ["other.html"])
+        self.assertEqual(len(self.build(workers=0, force=True).built), 3)
+
+    def test_failed_pages_are_reported(self):
+        self.write(self.data_dir, "bad.html.json", '{"template": "missing.html"}')
+        self.write(self.data_dir, "invalid.html.json", '[1, 2, 3]')
+        self.write(self.data_dir, "strict.html.json", '{"template": "other.html"}')
+        self.write(self.data_dir, "typed.html.json", '{"template": 5}')
+        result = self.build(workers=0)
+        self.assertEqual(sorted(result.errors), ["bad.html", "invalid.html", "typed.html"])
+        self.assertEqual(len(result.built), 4)
+        self.assertEqual(self.build(workers=0).built, [])
+
+    def test_command_line(self):
+        output = io.StringIO()
+        args = ["build", self.template_dir, "--data", self.data_dir, "--output", self.output_dir]
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(ibis.__main__.main(args + ["--workers", "0"]), 0)
+            self.assertEqual(ibis.__main__.main(args + ["--workers", "0"]), 0)
+        self.assertIn("Built 3 page(s), skipped 0 unchanged page(s).", output.getvalue())
+        self.assertIn("Built 0 page(s), skipped 3 unchanged page(s).", output.getvalue())
+
+
+class ThreadSafetyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base_dir = self.tempdir.name
+        self.write('a.txt', 'a-{{ var }}')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, filename, content, mtime=None):
+        path = os.path.join(self.base_dir, filename)
+        with open(path, 'w') as file:
+            file.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    # Calls `func` from `count` threads at once and returns the results or exceptions.
+    def call_concurrently(self, func, count=8):
+        barrier = threading.Barrier(count)
+        results = [None] * count
+
+        def target(index):
+            barrier.wait()
+            try:
+                results[index] = func()
+            except Exception as err:
+                results[index] = err
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    # Slows down the cache's compiles so concurrent requests overlap.
+    def slow_down(self, cache):
+        compile = cache.compile
+        def slow_compile(template_string, template_id):
+            time.sleep(0.05)
+            return compile(template_string, template_id)
+        cache.compile = slow_compile
+
+    def test_dict_loader_compiles_once(self):
+        loader = ibis.loaders.DictLoader({'a': 'a-{{ var }}'})
+        self.slow_down(loader.templates)
+        results = self.call_concurrently(lambda: loader('a'))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(results[0].render(var=1), 'a-1')
+        self.assertEqual(loader.stats()['compiles'], 1)
+        self.assertEqual(loader.generation, 0)
+
+    def test_file_loader_compiles_once(self):
+        loader = ibis.loaders.FileLoader(self.base_dir)
+        self.slow_down(loader.cache)
+        results = self.call_concurrently(lambda: loader('a.txt'))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(loader.stats()['compiles'], 1)
+        self.assertEqual(loader.stats()['misses'], 8)
+
+    def test_file_loader_errors_are_shared(self):
+        loader = ibis.loaders.FileLoader(self.base_dir)
+        self.write('bad.txt', '{% for %}')
+        results = self.call_concurrently(lambda: loader('bad.txt'))
+        self.assertTrue(all(isinstance(result, ibis.errors.TemplateSyntaxError) for result in results))
+        results = self.call_concurrently(lambda: loader('missing.txt'))
+        self.assertTrue(all(isinstance(result, ibis.errors.TemplateLoadError) for result in results))
+
+    def test_file_reloader_reloads_once(self):
+        loader = ibis.loaders.FileReloader(self.base_dir)
+        self.slow_down(loader.cache)
+        self.write('a.txt', 'a-{{ var }}', mtime=1000)
+        template = loader('a.txt')
+        self.write('a.txt', 'b-{{ var }}', mtime=2000)
+        results = self.call_concurrently(lambda: loader('a.txt'))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertIsNot(results[0], template)
+        self.assertEqual(results[0].render(var=1), 'b-1')
+        self.assertEqual(loader.stats()['compiles'], 2)
+
+    def test_stress(self):
+        result = bench_ibis.stress(threads=8, duration=0.5)
+        self.assertEqual(result.errors, [])
+        self.assertGreater(result.renders, 0)
+        self.assertGreater(result.rewrites, 0)
+
+
+class DiskCacheTests(unittest.TestCase):
+
+    def test_entries_are_written_and_reused(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            loader = ibis.loaders.FileLoader("tests/base1", cache_dir=cache_dir)
+            self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            loader = ibis.loaders.FileLoader("tests/base1", cache_dir=cache_dir)
+            key = loader.disk_cache.key("tests/base1/template-abc.ibis", "template-abc.ibis")
+            self.assertIsNotNone(loader.disk_cache.load(key))
+            self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+
+    def test_corrupt_entries_are_ignored(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            loader = ibis.loaders.FileReloader("tests/base1", cache_dir=cache_dir)
+            loader("template-abc.ibis")
+            for name in os.listdir(cache_dir):
+                with open(os.path.join(cache_dir, name), 'wb') as file:
+                    file.write(b'corrupt')
+
+            loader = ibis.loaders.FileReloader("tests/base1", cache_dir=cache_dir)
+            self.assertEqual(loader("template-abc.ibis").render().strip(), "abc")
+
+    def test_stale_entries_are_ignored(self):
+        with tempfile.TemporaryDirectory() as base_dir, tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(base_dir, "template.ibis")
+            with open(path, 'w') as file:
+                file.write("old")
+            ibis.loaders.FileLoader(base_dir, cache_dir=cache_dir)("template.ibis")
+
+            with open(path, 'w') as file:
+                file.write("new content")
+            loader = ibis.loaders.FileLoader(base_dir, cache_dir=cache_dir)
+            self.assertEqual(loader("template.ibis").render(), "new content")
+
+
+class PickleTests(unittest.TestCase):
+
+    template_string = (
+        '{# comment #}text{{ a|upper }}{$ b $}'
+        '{% for x, y in items %}{% cycle "odd", "even" %}{% empty %}none{% endfor %}'
+        '{% if a in b and not c %}1{% elif a not in "xyz" %}2{% else %}3{% endif %}'
+        '{% include "one-var" with var = a %}'
+        '{% block title %}{% spaceless %} <p> {{ b }} </p> {% endspaceless %}{% endblock %}'
+        '{% trim %} {% with z = a|lower %}{{ z }}{% endwith %} {% endtrim %}'
+        '{% cache "pickle", a %}{{ a }}{% endcache %}'
+    )
+
+    def collect_node_types(self, node, found):
+        found.add(type(node))
+        for child in node.children:
+            self.collect_node_types(child, found)
+        return found
+
+    def test_round_trip(self):
+        template = Template(self.template_string)
+        data = {'a': 'foo', 'b': 'foobar', 'c': False, 'items': [(1, 2)]}
+        expected = template.render(data)
+        unpickled = pickle.loads(pickle.dumps(template))
+        self.assertEqual(unpickled.render(data), expected)
+
+    def test_round_trip_covers_registered_node_types(self):
+        template = Template('{% extends "base" %}' + self.template_string)
+        unpickled = pickle.loads(pickle.dumps(template))
+        found = self.collect_node_types(unpickled.root_node, set())
+        registered = {node_class for node_class, _ in ibis.nodes.instruction_keywords.values()}
+        registered -= {EvilParser, EvilRenderer, GreetNode}
+        self.assertTrue(registered <= found, registered - found)
+
+    def test_round_trip_after_codegen(self):
+        template = Template(self.template_string)
+        template.code
+        unpickled = pickle.loads(pickle.dumps(template))
+        self.assertEqual(unpickled.render(a='x'), template.render(a='x'))
+
+
+class OptimizerTests(unittest.TestCase):
+
+    def node_types(self, template_string):
+        return [type(node) for node in Template(template_string).root_node.children]
+
+    def test_text_and_literal_prints_are_merged(self):
+        template = Template('foo{{ "bar"|upper }}{$ "<" $}{{ 123 }}{# comment #}baz')
+        self.assertEqual(len(template.root_node.children), 1)
+        self.assertEqual(template.render(), 'fooBAR&lt;123baz')
+
+    def test_folding_does_not_move_extends_into_first_place(self):
+        self.assertEqual(Template('{% if False %}x{% endif %}{% extends "base" %}').render(), '')
+        self.assertEqual(Template('{{ "" }}{% extends "base" %}').render(), '')
+        self.assertEqual(Template('{% extends "base" %}').render(var='x'), '|#|base-x|#|')
+
+    def test_literal_or_chain_is_folded(self):
+        self.assertEqual(self.node_types('{{ "" or 0 or "foo" }}'), [ibis.nodes.TextNode])
+        self.assertEqual(self.node_types('{{ "" or var }}'), [ibis.nodes.PrintNode])
+
+    def test_literal_if_is_folded(self):
+        template = Template('a{% if 1 > 2 %}b{% elif "x" in "xyz" %}c{% else %}d{% endif %}e')
+        self.assertEqual(len(template.root_node.children), 1)
+        self.assertEqual(template.render(), 'ace')
+
+    def test_if_with_variable_is_not_folded(self):
+        types = self.node_types('{% if 1 > 2 %}b{% elif var %}c{% endif %}')
+        self.assertEqual(types, [ibis.nodes.IfNode])
+
+    def test_if_with_invalid_literal_comparison_is_not_folded(self):
+        template = Template('{% if 1 < "a" %}b{% endif %}')
+        with self.assertRaises(ibis.errors.TemplateRenderingError):
+            template.render()
+
+    def test_if_containing_block_is_not_folded(self):
+        types = self.node_types('{% if False %}{% block foo %}{% endblock %}{% endif %}')
+        self.assertEqual(types, [ibis.nodes.IfNode])
+
+    def test_static_spaceless_and_trim_are_folded(self):
+        template = Template('{% spaceless %} <p> </p> {% endspaceless %}|{% trim %} x {% endtrim %}')
+        self.assertEqual(len(template.root_node.children), 1)
+        self.assertEqual(template.render(), '<p></p>|x')
+
+    def test_nested_branches_are_optimized(self):
+        template = Template('{% for i in [1] %}a{{ "b" }}{% if True %}c{% endif %}{{ i }}{% endfor %}')
+        for_branch = template.root_node.children[0].for_branch
+        self.assertEqual(len(for_branch.children), 2)
+        self.assertEqual(template.render(), 'abc1')
+
+    def test_children_match_optimized_branches(self):
+        for template_string in [
+            '{% for i in items %}{% if 0 %}{% include "x" %}{% endif %}{% endfor %}',
+            '{% if a %}{% if 0 %}{% include "x" %}{% endif %}{% else %}y{% endif %}',
+            '{% if a %}y{% elif b %}{% if 0 %}{% include "x" %}{% endif %}{% endif %}',
+        ]:
+            self.assertEqual(Template(template_string).dependencies(), set())
+
+
+class CodegenTests(unittest.TestCase):
+
+    templates = [
+        ('{% for a, b in items %}{{ loop.count }}:{{ a }}-{$ b $}{% empty %}none{% endfor %}', {}),
+        ('{% for i in [] %}{{ i }}{% empty %}none{% endfor %}', {}),
+        ('{% for i in [1, 2] %}{% for j in "ab" %}{{ loop.parent.index }}{{ j }}{% endfor %}{% endfor %}', {}),
+        ('{% if a == 1 and b or not c %}x{% elif d in e %}y{% else %}z{% endif %}', {}),
+        ('{{ missing or b|upper }}|{{ a ?? "t" :: "f" }}', {}),
+        ('{% with x = a & y = "lit"|upper %}{{ x }}{{ y }}{% endwith %}', {}),
+        ('{% include "two-vars" with var1 = a & var2 = b %}', {}),
+        ('{% extends "child" %}', {'var': 'v'}),
+        ('{% spaceless %} <p> {{ b }} </p> {% endspaceless %}|{% trim %}  x  {% endtrim %}', {}),
+        ('{% cycle "odd", "even" %}{% cycle "odd", "even" %}', {}),
+    ]
+
+    data = {'items': [(1, '<'), (2, '>')], 'a': 1, 'b': 'bee', 'c': 0, 'd': 3, 'e': [3]}
+
+    def render_both(self, template, data, **kwargs):
+        ibis.compiler.use_codegen = False
+        try:
+            expected = template.render(data, **kwargs)
+            ibis.compiler.use_codegen = True
+            rendered = template.render(data, **kwargs)
+        finally:
+            ibis.compiler.use_codegen = False
+        return expected, rendered
+
+    def test_identical_output(self):
+        for template_string, data in self.templates:
+            template = Template(template_string)
+            expected, rendered = self.render_both(template, {**self.data, **data})
+            self.assertEqual(rendered, expected)
+
+    def test_deep_nesting(self):
+        template_string = '{% for i in [1, 2] %}{% if i %}{% with x = i %}' * 12 + '{{ x }}'
+        template_string += '{% endwith %}{% endif %}{% endfor %}' * 12
+        expected, rendered = self.render_both(Template(template_string), {})
+        self.assertEqual(rendered, expected)
+
+    def test_rendering_error_message(self):
+        template = Template('foo\n{{ obj.raises_error }}', 'tmpl')
+        ibis.compiler.use_codegen = True
+        try:
+            with self.assertRaises(ibis.errors.TemplateRenderingError) as cm:
+                template.render(obj=ErrorThrower())
+        finally:
+            ibis.compiler.use_codegen = False
+        self.assertTrue(str(cm.exception).startswith("Template 'tmpl', line 2:"))
+
+    def test_generated_code_is_cached(self):
+        template = Template('{{ foo }}')
+        self.assertIs(template.code, template.code)
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.template = Template(
+            '<h1>{{ title|upper }}</h1>\n'
+            '{% for i in items %}\n'
+            '{% include "one-var" with var = i %}\n'
+            '{% endfor %}',
+            'page'
+        )
+        self.data = {'title': 'foo', 'items': [1, 2, 3]}
+
+    def result(self, profiler, template_id, line_number, label):
+        for result in profiler.results():
+            if (result['template_id'], result['line_number'], result['label']) == \
+                    (template_id, line_number, label):
+                return result
+        self.fail(f"No result for {template_id}:{line_number} {label}")
+
+    def test_profile(self):
+        output, profiler = self.template.profile(self.data)
+        self.assertEqual(output, self.template.render(self.data))
+        self.assertEqual(self.result(profiler, 'page', 1, '{{ title|upper }}')['calls'], 1)
+        self.assertEqual(self.result(profiler, 'page', 1, 'expr: title|upper')['calls'], 1)
+        self.assertEqual(self.result(profiler, 'page', 2, '{% for i in items %}')['calls'], 1)
+        self.assertEqual(self.result(profiler, 'page', 3, '{% include "one-var" with var = i %}')['calls'], 3)
+        self.assertEqual(self.result(profiler, 'one-var', 1, '{{ var }}')['calls'], 3)
+        for result in profiler.results():
+            self.assertGreaterEqual(result['inclusive'], result['exclusive'])
+        loop = self.result(profiler, 'page', 2, '{% for i in items %}')
+        include = self.result(profiler, 'page', 3, '{% include "one-var" with var = i %}')
+        self.assertGreater(loop['inclusive'], include['inclusive'])
+
+    def test_profiling_is_off_outside_profiler(self):
+        with ibis.profiler.Profiler() as profiler:
+            self.assertIsNot(ibis.nodes.Node.render, ibis.profiler._node_render)
+        self.assertIs(ibis.nodes.Node.render, ibis.profiler._node_render)
+        self.assertIs(ibis.nodes.Expression.eval, ibis.profiler._expression_eval)
+        self.template.render(self.data)
+        self.assertEqual(profiler.results(), [])
+
+    def test_only_one_profiler_can_run(self):
+        with ibis.profiler.Profiler():
+            with self.assertRaises(RuntimeError):
+                ibis.profiler.Profiler().start()
+        with ibis.profiler.Profiler():
+            pass
+
+    def test_codegen_is_restored(self):
+        ibis.compiler.use_codegen = True
+        try:
+            output, profiler = self.template.profile(self.data)
+            self.assertTrue(ibis.compiler.use_codegen)
+            self.assertEqual(output, self.template.render(self.data))
+            self.assertEqual(self.result(profiler, 'one-var', 1, '{{ var }}')['calls'], 3)
+        finally:
+            ibis.compiler.use_codegen = False
+
+    def test_errors_are_recorded(self):
+        template = Template('{{ foo }}{{ bar() }}', 'error')
+        with ibis.profiler.Profiler() as profiler:
+            with self.assertRaises(ibis.errors.TemplateRenderingError):
+                template.render(foo=1, bar=lambda: 1 / 0)
+        self.assertEqual(self.result(profiler, 'error', 1, '{{ bar() }}')['calls'], 1)
+        self.assertEqual(profiler.calls[('error', 1, '{{ foo }}')], 1)
+
+    def test_other_threads_are_ignored(self):
+        with ibis.profiler.Profiler() as profiler:
+            thread = threading.Thread(target=self.template.render, args=(self.data,))
+            thread.start()
+            thread.join()
+        self.assertEqual(profiler.results(), [])
+
+    def test_recursive_calls_are_not_double_counted(self):
+        default_loader = ibis.loader
+        ibis.loader = ibis.loaders.DictLoader({
+            'tree': '{% for child in node.children %}{% include "tree" with node = child %}{% endfor %}',
+        })
+        try:
+            tree = {'children': [{'children': [{'children': []}]}]}
+            with ibis.profiler.Profiler() as profiler:
+                start = time.perf_counter()
+                ibis.loader('tree').render(node=tree)
+                elapsed = time.perf_counter() - start
+        finally:
+            ibis.loader = default_loader
+        include = self.result(profiler, 'tree', 1, '{% include "tree" with node = child %}')
+        self.assertEqual(include['calls'], 2)
+        self.assertLessEqual(include['inclusive'], elapsed)
+
+    def test_output_formats(self):
+        output, profiler = self.template.profile(self.data)
+        self.assertEqual(json.loads(profiler.to_json()), profiler.results())
+        report = profiler.report(limit=2).splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertIn("excl ms", report[0])
+        lines = profiler.to_collapsed().splitlines()
+        self.assertIn(
+            'page:2 {% for i in items %};page:3 {% include "one-var" with var = i %};one-var:1 {{ var }}',
+            [line.rsplit(' ', 1)[0] for line in lines]
+        )
+        for line in lines:
+            self.assertTrue(line.rsplit(' ', 1)[1].isdigit())
+        self.assertEqual(profiler.results(sort='calls')[0]['calls'], 3)
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_mann_whitney(self):
+        baseline = [1.0, 1.1, 0.9, 1.05, 0.95, 1.02, 0.98, 1.01]
+        slower = [value * 1.5 for value in baseline]
+        self.assertLess(bench_ibis.mann_whitney_p(baseline, slower), 0.01)
+        self.assertGreater(bench_ibis.mann_whitney_p(slower, baseline), 0.99)
+        self.assertGreater(bench_ibis.mann_whitney_p(baseline, baseline), 0.3)
+        self.assertGreater(bench_ibis.mann_whitney_p([1.0] * 5, [1.0] * 5), 0.3)
+
+    def test_compare(self):
+        samples = [1.0, 1.1, 0.9, 1.05, 0.95, 1.02, 0.98, 1.01]
+        baseline = {'benchmarks': {
+            'a': {'samples': samples},
+            'b': {'samples': samples},
+            'c': {'samples': samples},
+            'd': {'samples': samples},
+            'old': {'samples': samples},
+        }}
+        current = {'benchmarks': {
+            'a': {'samples': [value * 1.5 for value in samples]},
+            'b': {'samples': [value * 0.5 for value in samples]},
+            'c': {'samples': [value * 1.01 for value in samples]},
+            'd': {'samples': [2.0]},
+            'new': {'samples': samples},
+        }}
+        rows = {row[0]: row for row in bench_ibis.compare(baseline, current)}
+        self.assertEqual(sorted(rows), ['a', 'b', 'c', 'd'])
+        self.assertEqual(rows['a'][5], 'slower')
+        self.assertEqual(rows['b'][5], 'faster')
+        self.assertEqual(rows['c'][5], '')
+        self.assertEqual(rows['d'][5], '')
+        self.assertAlmostEqual(rows['a'][3], 0.5)
+
+    def test_run_and_compare(self):
+        default_loader = ibis.loader
+        default_codegen = ibis.compiler.use_codegen
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "baseline.json")
+            args = ["--filter", "render_inheritance", "--repeat", "3", "--min-time", "0"]
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(bench_ibis.main(args + ["--output", path]), 0)
+                with open(path) as file:
+                    results = json.load(file)
+                self.assertEqual(list(results['benchmarks']), ['render_inheritance'])
+                self.assertEqual(len(results['benchmarks']['render_inheritance']['samples']), 3)
+                bench_ibis.main(args + ["--compare", path, "--codegen"])
+            self.assertIn("render_inheritance", output.getvalue())
+        self.assertIs(ibis.loader, default_loader)
+        self.assertIs(ibis.compiler.use_codegen, default_codegen)
+
+
 if __name__ == '__main__':
     unittest.main()